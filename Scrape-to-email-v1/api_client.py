@@ -1,26 +1,113 @@
 import requests
-import time
+import hashlib
+import json
 import logging
-from config import SEARCH_EXPRESSION
+import os
+import threading
+from config import SEARCH_EXPRESSION, Config
+from utils import http_client
+from utils.sqlite_cache import SQLiteCache
+from utils.token_bucket import TokenBucket
 
-class RateLimiter:
-    def __init__(self, calls_per_second=3):
-        self.calls_per_second = calls_per_second
-        self.last_call = 0
+BASE_URL = "https://clinicaltrials.gov/api/v2/studies"
 
-    def wait(self):
-        now = time.time()
-        time_passed = now - self.last_call
-        if time_passed < (1.0 / self.calls_per_second):
-            time.sleep((1.0 / self.calls_per_second) - time_passed)
-        self.last_call = time.time()
+# The API coerces larger page sizes down to 1,000
+MAX_PAGE_SIZE = 1000
 
-rate_limiter = RateLimiter()
+rate_limiter = TokenBucket(
+    rate=Config.CTGOV_REQUESTS_PER_SECOND,
+    capacity=Config.CTGOV_BURST,
+    state_path=Config.CTGOV_RATE_LIMIT_DB,
+    name='clinicaltrials.gov'
+)
+
+transfer_lock = threading.Lock()
+transfer_stats = {'bytes': 0, 'studies': 0}
+
+_cache_lock = threading.Lock()
+_response_cache = None
+_response_cache_pid = None
+
+def get_response_cache():
+    """Return this process's on-disk response cache, or None when caching is disabled"""
+    global _response_cache, _response_cache_pid
+    if not Config.CTGOV_CACHE_ENABLED:
+        return None
+    pid = os.getpid()
+    if _response_cache is None or _response_cache_pid != pid:
+        with _cache_lock:
+            if _response_cache is None or _response_cache_pid != pid:
+                _response_cache = SQLiteCache(
+                    Config.CTGOV_CACHE_PATH,
+                    ttl=Config.CTGOV_CACHE_TTL,
+                    max_bytes=Config.CTGOV_CACHE_MAX_MB * 1024 * 1024,
+                    name='clinicaltrials.gov'
+                )
+                _response_cache_pid = pid
+    return _response_cache
+
+def cache_key(url, params):
+    """Key a request on its endpoint and normalized params, pageToken included"""
+    normalized = sorted(
+        (str(name), ' '.join(str(value).split()))
+        for name, value in params.items()
+        if value is not None and value != ''
+    )
+    return hashlib.sha256(json.dumps([url, normalized]).encode('utf-8')).hexdigest()
+
+def record_transfer(content, data):
+    with transfer_lock:
+        transfer_stats['bytes'] += len(content)
+        transfer_stats['studies'] += len(data.get('studies', []))
+
+def get_json(url, params, use_cache=True):
+    """
+    GET a JSON response from ClinicalTrials.gov. Fresh cached responses are
+    served without any network I/O; stale ones are revalidated with
+    If-None-Match / If-Modified-Since when the server sent validators.
+    """
+    cache = get_response_cache() if use_cache else None
+    key = entry = None
+    headers = {}
+    if cache:
+        key = cache_key(url, params)
+        entry = cache.get_entry(key)
+        if entry and entry['fresh']:
+            logging.debug(f"Cache hit for {url} with params: {params}")
+            data = json.loads(entry['value'])
+            record_transfer(entry['value'], data)
+            return data
+        if entry:
+            if entry['meta'].get('etag'):
+                headers['If-None-Match'] = entry['meta']['etag']
+            if entry['meta'].get('last_modified'):
+                headers['If-Modified-Since'] = entry['meta']['last_modified']
 
-def fetch_studies(expr, fields, pageToken=None):
     rate_limiter.wait()
-    
-    base_url = "https://clinicaltrials.gov/api/v2/studies"
+    logging.debug(f"Requesting URL: {url} with params: {params}")
+    response = http_client.get(url, params=params, headers=headers)
+
+    if entry and response.status_code == 304:
+        cache.touch(key)
+        data = json.loads(entry['value'])
+        record_transfer(entry['value'], data)
+        return data
+
+    if response.status_code != 200:
+        logging.error(f"API Response: {response.text}")
+    response.raise_for_status()
+
+    if cache:
+        cache.set(key, response.content, {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified')
+        })
+    data = response.json()
+    record_transfer(response.content, data)
+    return data
+
+def fetch_studies(expr, fields, pageToken=None):
+    base_url = BASE_URL
     params = {
         'query.cond': expr,  # Changed from 'query' to 'query.cond'
         'fields': ','.join(fields),
@@ -32,54 +119,186 @@ def fetch_studies(expr, fields, pageToken=None):
         params['pageToken'] = pageToken
     
     try:
-        logging.debug(f"Requesting URL: {base_url} with params: {params}")
-        response = requests.get(base_url, params=params)
-        response.raise_for_status()
-        return response.json()
+        return get_json(base_url, params)
     except requests.exceptions.HTTPError as e:
-        logging.error(f"API Error: {str(e)}\nResponse content: {response.text}")
+        logging.error(f"API Error: {str(e)}")
         raise
     except KeyboardInterrupt:
         logging.info("\nFetch interrupted by user")
         return {'studies': [], 'totalCount': 0}
 
-def fetch_all_studies(fields_to_extract, search_query=None, limit=None):
-    """
-    Fetch studies from ClinicalTrials.gov API with optional search parameters
-    """
-    base_url = "https://clinicaltrials.gov/api/v2/studies"
-    
-    # Build query parameters
+# search_query keys and the API parameters they compile to
+SEARCH_QUERY_PARAMS = {
+    'condition': 'query.cond',
+    'main': 'query.term',
+    'advanced': 'filter.advanced',
+    'status': 'filter.overallStatus',
+    'geo': 'filter.geo',
+    'post_status': 'postFilter.overallStatus',
+    'post_advanced': 'postFilter.advanced',
+    'post_geo': 'postFilter.geo'
+}
+
+def build_study_params(fields_to_extract, search_query=None):
+    """Build the query parameters shared by every page of a studies query"""
     params = {
         'fields': ','.join(fields_to_extract),
         'format': 'json'
     }
-    
-    # Add search parameters if provided
-    if search_query:
-        if 'condition' in search_query:
-            params['query.cond'] = search_query['condition']
-            
-        if 'main' in search_query:
-            params['query.term'] = search_query['main']
-    
-    # Add limit if specified
-    if limit:
-        params['pageSize'] = str(limit)
+
+    for key, value in (search_query or {}).items():
+        if key not in SEARCH_QUERY_PARAMS or not value:
+            continue
+        if isinstance(value, (list, tuple)):
+            value = '|'.join(value)
+        params[SEARCH_QUERY_PARAMS[key]] = value
+
+    return params
+
+def compile_targeting_rules(rules):
+    """
+    Compile our targeting rules into server-side filters so rejected
+    studies never leave ClinicalTrials.gov. Supported rules: statuses,
+    study_types, phases, require_contact_email, geo (lat, lon, distance)
+    and post_statuses.
+    """
+    query = {}
+    clauses = []
+
+    if rules.get('statuses'):
+        query['status'] = list(rules['statuses'])
+    if rules.get('post_statuses'):
+        query['post_status'] = list(rules['post_statuses'])
+
+    if rules.get('study_types'):
+        clauses.append(' OR '.join(f'AREA[StudyType]{study_type}' for study_type in rules['study_types']))
+    if rules.get('phases'):
+        clauses.append(' OR '.join(f'AREA[Phase]{phase}' for phase in rules['phases']))
+    if rules.get('require_contact_email'):
+        # Contacts without an email are skipped downstream, so drop studies that have none
+        clauses.append('NOT (AREA[CentralContactEMail]MISSING AND AREA[LocationContactEMail]MISSING)')
+    if clauses:
+        query['advanced'] = ' AND '.join(f'({clause})' for clause in clauses)
+
+    if rules.get('geo'):
+        latitude, longitude, distance = rules['geo']
+        query['geo'] = f'distance({latitude},{longitude},{distance})'
+
+    return query
+
+def targeted_query(search_query, rules):
+    """Combine a search query with compiled targeting rules"""
+    query = dict(search_query)
+    for key, value in compile_targeting_rules(rules).items():
+        if key in ('advanced', 'post_advanced') and query.get(key):
+            query[key] = f"({query[key]}) AND {value}"
+        else:
+            query[key] = value
+    return query
+
+def log_pushdown_savings(search_query, pushed_query):
+    """
+    Log how many studies and roughly how many bytes the server-side filters
+    kept off the wire, using countTotal and the bytes per study observed so far.
+    """
+    unfiltered = count_studies(search_query)
+    filtered = count_studies(pushed_query)
+    studies_saved = max(0, unfiltered - filtered)
+
+    with transfer_lock:
+        bytes_per_study = transfer_stats['bytes'] / transfer_stats['studies'] if transfer_stats['studies'] else 0
+    bytes_saved = int(studies_saved * bytes_per_study)
+
+    logging.info(
+        f"Filter pushdown kept {studies_saved} of {unfiltered} studies off the wire "
+        f"(~{bytes_saved / (1024 * 1024):.1f} MB at {bytes_per_study:.0f} bytes/study)"
+    )
+    return {'studies_saved': studies_saved, 'bytes_saved': bytes_saved}
+
+def iter_study_pages(fields_to_extract, search_query=None, page_size=MAX_PAGE_SIZE,
+                     max_pages=None, max_studies=None):
+    """
+    Yield pages of studies from ClinicalTrials.gov, following nextPageToken
+    until the last page, max_pages pages, or max_studies studies.
+    """
+    params = build_study_params(fields_to_extract, search_query)
+    page_size = min(page_size, MAX_PAGE_SIZE)
+    if max_pages is None:
+        max_pages = Config.CTGOV_MAX_PAGES
+
+    pages_fetched = 0
+    studies_fetched = 0
+    if max_studies is not None and max_studies <= 0:
+        return
+
+    while True:
+        if max_studies is not None:
+            params['pageSize'] = min(page_size, max_studies - studies_fetched)
+        else:
+            params['pageSize'] = page_size
+
+        try:
+            logging.info(f"Requesting URL: {BASE_URL} with params: {params}")
+            data = get_json(BASE_URL, params)
+
+        except requests.exceptions.RequestException as e:
+            logging.error(f"Error fetching studies: {str(e)}")
+            raise
+
+        studies = data.get('studies', [])
+        if max_studies is not None:
+            studies = studies[:max_studies - studies_fetched]
+
+        pages_fetched += 1
+        studies_fetched += len(studies)
+        logging.info(f"Fetched page {pages_fetched} with {len(studies)} studies ({studies_fetched} total)")
+        yield studies
+
+        next_page_token = data.get('nextPageToken')
+        if not next_page_token:
+            stats = rate_limiter.get_stats()
+            logging.info(f"Pagination finished; rate limiter has waited {stats['total_wait']:.1f}s over {stats['calls']} calls")
+            cache = get_response_cache()
+            if cache:
+                cache_stats = cache.get_stats()
+                logging.info(
+                    f"Response cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+                    f"{cache_stats['revalidated']} revalidated"
+                )
+            break
+        if max_pages and pages_fetched >= max_pages:
+            logging.info(f"Stopping pagination at page cap of {max_pages}")
+            break
+        if max_studies is not None and studies_fetched >= max_studies:
+            break
+
+        params['pageToken'] = next_page_token
+
+def fetch_study(nct_id, fields_to_extract):
+    """Fetch a single study by NCT ID"""
+    return get_json(f"{BASE_URL}/{nct_id}", {'fields': ','.join(fields_to_extract)})
+
+def count_studies(search_query=None):
+    """Return the total number of studies matching a query, fetching a single study"""
+    params = build_study_params(['protocolSection.identificationModule.nctId'], search_query)
+    params['countTotal'] = 'true'
+    params['pageSize'] = 1
 
     try:
-        logging.info(f"Requesting URL: {base_url} with params: {params}")
-        response = requests.get(base_url, params=params)
-        
-        if response.status_code != 200:
-            logging.error(f"API Response: {response.text}")
-        
-        response.raise_for_status()
-        data = response.json()
-        return data.get('studies', [])
-        
+        logging.debug(f"Counting studies with params: {params}")
+        return get_json(BASE_URL, params).get('totalCount', 0)
     except requests.exceptions.RequestException as e:
-        logging.error(f"Error fetching studies: {str(e)}")
+        logging.error(f"Error counting studies: {str(e)}")
         raise
 
-# Remove the example usage line that was causing the error
\ No newline at end of file
+def iter_studies(fields_to_extract, search_query=None, **kwargs):
+    """Yield studies one at a time, holding only the current page in memory"""
+    for page in iter_study_pages(fields_to_extract, search_query, **kwargs):
+        yield from page
+
+def fetch_all_studies(fields_to_extract, search_query=None, limit=None):
+    """
+    Fetch studies from ClinicalTrials.gov API with optional search parameters.
+    Follows pagination to the end of the result set, or to limit studies.
+    """
+    return list(iter_studies(fields_to_extract, search_query, max_studies=limit))
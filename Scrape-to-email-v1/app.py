@@ -1,10 +1,19 @@
 # app.py
 import logging
+import click
 from flask import Flask
 from main import StudyManager
-from config import Config
+from config import Config, SEARCH_EXPRESSION
 from models import db_manager
 from test_clinicaltrials_fetch import test_bp
+from generate import gi_bp
+from upload import upload_bp
+from bulk_ingest import ingest_dump
+from api_client import fetch_all_studies
+from projection import plan_fields
+from study_processor import StudyProcessor
+from storage import DataStorage
+from utils import token_counter
 from dotenv import load_dotenv
 import os
 
@@ -36,6 +45,9 @@ def create_app(config_class=Config):
         app.logger.error(f"Failed to setup database: {str(e)}")
         raise
 
+    # Load the token encoder and precount prompt templates before serving requests
+    token_counter.warm_up()
+
     # Initialize extensions
     study_manager = StudyManager(app.config)
     
@@ -51,8 +63,51 @@ def create_app(config_class=Config):
             app.logger.error(f"Failed to update studies: {str(e)}", exc_info=True)
             raise
 
+    @app.cli.command('sync-studies')
+    def sync_studies():
+        """Pull only studies updated since the last sync and generate their emails"""
+        try:
+            app.logger.info("Starting incremental clinical studies sync...")
+            study_manager.fetch_and_store_data(incremental=True)
+            app.logger.info("Incremental clinical studies sync completed successfully")
+        except Exception as e:
+            app.logger.error(f"Failed to sync studies: {str(e)}", exc_info=True)
+            raise
+
+    @app.cli.command('ingest-dump')
+    @click.argument('path')
+    @click.option('--workers', type=int, default=None, help='Worker processes for archive members')
+    def ingest_dump_command(path, workers):
+        """Seed studies from a local ClinicalTrials.gov export zip, directory or JSON file"""
+        try:
+            app.logger.info(f"Ingesting bulk dump from {path}...")
+            count = ingest_dump(path, DataStorage(), workers=workers)
+            app.logger.info(f"Bulk ingest completed: {count} studies")
+        except Exception as e:
+            app.logger.error(f"Failed to ingest dump: {str(e)}", exc_info=True)
+            raise
+
+    @app.cli.command('generate-offline')
+    @click.option('--limit', type=int, default=None, help='Maximum number of studies to generate for')
+    def generate_offline(limit):
+        """Generate GI study emails through an offline Azure batch job"""
+        try:
+            app.logger.info("Starting offline batch email generation...")
+            fields = plan_fields('study_processor', 'study_clustering')
+            studies = fetch_all_studies(fields, search_query={'condition': SEARCH_EXPRESSION}, limit=limit)
+            processor = StudyProcessor(app.config)
+            processed_data = processor.process_studies_offline(studies)
+            DataStorage().save_data(processed_data, 'gi_studies.json')
+            stats = processor.get_processing_stats()
+            app.logger.info(f"Offline generation completed: {stats['successful']} succeeded, {stats['failed']} failed")
+        except Exception as e:
+            app.logger.error(f"Failed to generate emails offline: {str(e)}", exc_info=True)
+            raise
+
     # Register blueprints
     app.register_blueprint(test_bp, url_prefix='/test')
+    app.register_blueprint(gi_bp, url_prefix='/gi')
+    app.register_blueprint(upload_bp, url_prefix='/upload')
 
     return app
 
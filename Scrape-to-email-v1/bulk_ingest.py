@@ -0,0 +1,192 @@
+import io
+import json
+import logging
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from config import SEARCH_KEYWORDS
+from data_extractor import extract_fields
+from projection import plan_fields, project_study
+from study_sync import STUDY_STORE_FILE, SYNC_STATE_FILE, get_last_update, get_nct_id, load_or_default, query_key
+from study_sync import storage as sync_storage
+
+CHUNK_SIZE = 64 * 1024
+
+def iter_json_array(fp, chunk_size=CHUNK_SIZE):
+    """
+    Yield the elements of a top-level JSON array (or a single top-level
+    object) from a text stream, holding only one element and one chunk in
+    memory at a time.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    started = False
+    eof = False
+
+    while True:
+        if not eof and len(buffer) < chunk_size:
+            chunk = fp.read(chunk_size)
+            if chunk:
+                buffer += chunk
+            else:
+                eof = True
+
+        buffer = buffer.lstrip()
+        if not started:
+            if not buffer:
+                if eof:
+                    return
+                continue
+            if buffer[0] == '{':
+                # A single study per file, e.g. one member of the full export
+                yield json.loads(buffer + fp.read())
+                return
+            if buffer[0] != '[':
+                raise ValueError("Expected a JSON array or object")
+            buffer = buffer[1:]
+            started = True
+            continue
+
+        buffer = buffer.lstrip(', \n\r\t')
+        if buffer.startswith(']'):
+            return
+        if not buffer:
+            if eof:
+                raise ValueError("Unterminated JSON array")
+            continue
+
+        try:
+            element, end = decoder.raw_decode(buffer)
+            # A number cut at the buffer's edge decodes as a shorter one, so only
+            # take an element once the separator after it has been read
+            complete = eof or buffer[end:].lstrip()[:1] in (',', ']')
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            complete = False
+        if not complete:
+            # Element spans past the buffer; read more before decoding
+            chunk = fp.read(chunk_size)
+            if chunk:
+                buffer += chunk
+            else:
+                eof = True
+            continue
+
+        yield element
+        buffer = buffer[end:]
+
+def list_members(path):
+    """List the JSON files in a full-export zip, a directory, or a single file"""
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            return [name for name in archive.namelist() if name.endswith('.json')]
+    if os.path.isdir(path):
+        members = []
+        for root, _, files in os.walk(path):
+            for name in files:
+                if name.endswith('.json'):
+                    members.append(os.path.relpath(os.path.join(root, name), path))
+        return sorted(members)
+    return ['']
+
+def iter_member_studies(path, member, archive=None):
+    """Yield the studies stored in one archive member or file"""
+    if archive is not None:
+        with archive.open(member) as raw, io.TextIOWrapper(raw, encoding='utf-8') as fp:
+            yield from iter_json_array(fp)
+    else:
+        with open(os.path.join(path, member) if member else path, 'r', encoding='utf-8') as fp:
+            yield from iter_json_array(fp)
+
+def extract_members(path, members, fields):
+    """Process pool worker: parse a batch of archive members and project their studies onto fields"""
+    archive = zipfile.ZipFile(path) if zipfile.is_zipfile(path) else None
+    extracted = []
+    try:
+        for member in members:
+            try:
+                extracted.extend(project_study(study, fields) for study in iter_member_studies(path, member, archive))
+            except Exception as e:
+                logging.error(f"Failed to ingest {member or path}: {str(e)}")
+    finally:
+        if archive is not None:
+            archive.close()
+    return extracted
+
+def iter_dump(path, fields, workers=None, batch_size=500):
+    """
+    Yield batches of studies, projected onto fields, from a
+    ClinicalTrials.gov full-export zip, a directory of per-study JSON
+    files, or a single JSON array file. Archive members are parsed across a
+    process pool with at most two batches in flight per worker.
+    """
+    members = list_members(path)
+    logging.info(f"Ingesting {len(members)} files from {path}")
+
+    if members == ['']:
+        # One large array file cannot be split across processes; stream it here
+        batch = []
+        for study in iter_member_studies(path, ''):
+            batch.append(project_study(study, fields))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+        return
+
+    workers = workers or os.cpu_count() or 1
+    batches = (members[i:i + batch_size] for i in range(0, len(members), batch_size))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for member_batch in batches:
+            pending.add(executor.submit(extract_members, path, member_batch, fields))
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in pending:
+            yield future.result()
+
+def ingest_dump(path, storage, filename='bulk_studies.jsonl', workers=None, queries=None):
+    """
+    Seed a fresh deployment from a local dump. Every study is merged by NCT
+    ID into the incremental sync's study store, projected the way the sync
+    fetches it, and each query's high-water mark is moved up to the newest
+    LastUpdatePostDate in the dump, so the next sync only fetches what
+    changed since the export. The extracted records are also written to
+    filename as JSON lines.
+    """
+    fields = plan_fields('data_extractor', 'study_sync')
+    store = load_or_default(STUDY_STORE_FILE)
+    total = 0
+    newest = None
+
+    def records():
+        nonlocal total, newest
+        for batch in iter_dump(path, fields, workers):
+            total += len(batch)
+            for study in batch:
+                nct_id = get_nct_id(study)
+                if nct_id:
+                    store[nct_id] = study
+                last_update = get_last_update(study)
+                if last_update and (newest is None or last_update > newest):
+                    newest = last_update
+            yield from extract_fields(batch)
+
+    storage.save_jsonl(records(), filename)
+    sync_storage.save_data(store, STUDY_STORE_FILE)
+
+    if newest:
+        state = load_or_default(SYNC_STATE_FILE)
+        for search_query in queries or [{'condition': keyword} for keyword in SEARCH_KEYWORDS]:
+            key = query_key(search_query)
+            query_state = state.get(key, {})
+            if query_state.get('high_water_mark', '') < newest:
+                state[key] = dict(query_state, query=search_query, high_water_mark=newest, seeded_from=path)
+        sync_storage.save_data(state, SYNC_STATE_FILE)
+
+    logging.info(f"Ingested {total} studies from {path}; sync high-water mark seeded at {newest}")
+    return total
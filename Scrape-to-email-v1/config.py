@@ -1,6 +1,7 @@
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 import os
+import tempfile
 
 load_dotenv()
 
@@ -15,34 +16,87 @@ class Config:
     SECRET_KEY = os.getenv('SECRET_KEY')
     TOTAL_TOKENS_PER_MINUTE = int(os.getenv('TOTAL_TOKENS_PER_MINUTE', 2000000))
     TOKEN_ENCODING = os.getenv('TOKEN_ENCODING', 'cl100k_base')
+    LLM_MAX_WORKERS = int(os.getenv('LLM_MAX_WORKERS', 8))  # Concurrent generation calls
+    # Batched generation packs several studies into one request
+    LLM_BATCH_GENERATION = os.getenv('LLM_BATCH_GENERATION', 'true').lower() == 'true'
+    LLM_BATCH_MAX_TOKENS = int(os.getenv('LLM_BATCH_MAX_TOKENS', 3900))  # Completion cap; same as azure_config.DEFAULT_MAX_TOKENS
+    LLM_BATCH_MAX_STUDIES = int(os.getenv('LLM_BATCH_MAX_STUDIES', 10))
+    LLM_TOKENS_PER_STUDY = int(os.getenv('LLM_TOKENS_PER_STUDY', 900))  # Two emails of ~200+ words
+    LLM_RUN_TOKEN_CAP = int(os.getenv('LLM_RUN_TOKEN_CAP', 0))  # Per-run token spend cap, 0 for none
+    # Templated emails stand in when generation fails and for low-priority contacts
+    LLM_TEMPLATE_FALLBACK = os.getenv('LLM_TEMPLATE_FALLBACK', 'true').lower() == 'true'
+    LLM_MIN_CONTACT_PRIORITY = int(os.getenv('LLM_MIN_CONTACT_PRIORITY', 2))
+    # Near-duplicate studies share one generated base email
+    LLM_CLUSTER_STUDIES = os.getenv('LLM_CLUSTER_STUDIES', 'false').lower() == 'true'
+    LLM_CLUSTER_MAX_DISTANCE = int(os.getenv('LLM_CLUSTER_MAX_DISTANCE', 3))  # Title SimHash bits, at most 7
     
+    CTGOV_CACHE_ENABLED = os.getenv('CTGOV_CACHE_ENABLED', 'true').lower() == 'true'
+    CTGOV_CACHE_PATH = os.getenv('CTGOV_CACHE_PATH', os.path.join('data', 'ctgov_cache.sqlite'))
+    CTGOV_CACHE_TTL = int(os.getenv('CTGOV_CACHE_TTL', 12 * 60 * 60))  # Registry refreshes daily
+    CTGOV_CACHE_MAX_MB = int(os.getenv('CTGOV_CACHE_MAX_MB', 512))
+
+    # Offline Batch Job Settings
+    AZURE_BATCH_ENDPOINT = os.getenv('AZURE_BATCH_ENDPOINT')  # e.g. local_batch_server.py
+    AZURE_BATCH_API_VERSION = os.getenv('AZURE_BATCH_API_VERSION')
+    AZURE_BATCH_POLL_INTERVAL = float(os.getenv('AZURE_BATCH_POLL_INTERVAL', 30))
+    AZURE_BATCH_MAX_POLL_INTERVAL = float(os.getenv('AZURE_BATCH_MAX_POLL_INTERVAL', 600))
+    AZURE_BATCH_TIMEOUT = float(os.getenv('AZURE_BATCH_TIMEOUT', 24 * 60 * 60))
+
+    # Hedged Request Settings
+    LLM_HEDGE_ENABLED = os.getenv('LLM_HEDGE_ENABLED', 'false').lower() == 'true'
+    AZURE_OPENAI_HEDGE_DEPLOYMENT = os.getenv('AZURE_OPENAI_HEDGE_DEPLOYMENT')  # Defaults to the primary deployment
+    LLM_HEDGE_PERCENTILE = float(os.getenv('LLM_HEDGE_PERCENTILE', 95))
+    LLM_HEDGE_MIN_SAMPLES = int(os.getenv('LLM_HEDGE_MIN_SAMPLES', 20))
+    LLM_HEDGE_INITIAL_DELAY = float(os.getenv('LLM_HEDGE_INITIAL_DELAY', 15))  # Until enough latencies are seen
+    LLM_HEDGE_MAX_FRACTION = float(os.getenv('LLM_HEDGE_MAX_FRACTION', 0.05))  # Duplicate share of tokens sent
+
+    # LLM Completion Cache Settings
+    LLM_CACHE_ENABLED = os.getenv('LLM_CACHE_ENABLED', 'true').lower() == 'true'
+    LLM_CACHE_PATH = os.getenv('LLM_CACHE_PATH', os.path.join('data', 'llm_cache.sqlite'))
+    LLM_CACHE_TTL = int(os.getenv('LLM_CACHE_TTL', 30 * 24 * 60 * 60))
+    LLM_CACHE_MAX_MB = int(os.getenv('LLM_CACHE_MAX_MB', 256))
+    # Only cache completions that pass StudyProcessor.validate_email_content
+    LLM_CACHE_VALIDATED_ONLY = os.getenv('LLM_CACHE_VALIDATED_ONLY', 'true').lower() == 'true'
+
+    # Outbound HTTP Settings
+    HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 5))
+    HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', 30))
+    CTGOV_READ_TIMEOUT = float(os.getenv('CTGOV_READ_TIMEOUT', 60))
+    AZURE_READ_TIMEOUT = float(os.getenv('AZURE_READ_TIMEOUT', 30))
+    AZURE_MIN_TOKENS_PER_SECOND = float(os.getenv('AZURE_MIN_TOKENS_PER_SECOND', 20))  # Slowest expected generation rate
+    HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', 10))
+    CTGOV_POOL_SIZE = int(os.getenv('CTGOV_POOL_SIZE', 10))
+    AZURE_POOL_SIZE = int(os.getenv('AZURE_POOL_SIZE', 20))
+
+    # Retry and Circuit Breaker Settings
+    RETRY_MAX_ATTEMPTS = int(os.getenv('RETRY_MAX_ATTEMPTS', 5))
+    RETRY_BASE_DELAY = float(os.getenv('RETRY_BASE_DELAY', 0.5))
+    RETRY_MAX_DELAY = float(os.getenv('RETRY_MAX_DELAY', 30))
+    RETRY_MAX_RETRY_AFTER = float(os.getenv('RETRY_MAX_RETRY_AFTER', 120))
+    RETRY_BUDGET = int(os.getenv('RETRY_BUDGET', 500))  # Retries allowed per run
+    CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', 5))
+    CIRCUIT_RESET_TIMEOUT = float(os.getenv('CIRCUIT_RESET_TIMEOUT', 30))
+
     # Email Configuration
     EMAIL_SENDER = os.getenv('EMAIL_SENDER')
     EMAIL_PASSWORD = os.getenv('EMAIL_PASSWORD')
     SMTP_SERVER = os.getenv('SMTP_SERVER')
     SMTP_PORT = int(os.getenv('SMTP_PORT', 587))
 
-# Calculate date three months AGO (not ahead)
-three_months_ago = (datetime.now() - timedelta(days=90)).strftime('%Y/%m/%d')
+    # ClinicalTrials.gov API Settings
+    CTGOV_MAX_PAGES = int(os.getenv('CTGOV_MAX_PAGES', 0))  # 0 follows every page
+    CTGOV_FANOUT_WORKERS = int(os.getenv('CTGOV_FANOUT_WORKERS', 4))
+    CTGOV_REQUESTS_PER_SECOND = float(os.getenv('CTGOV_REQUESTS_PER_SECOND', 3))
+    CTGOV_BURST = int(os.getenv('CTGOV_BURST', 5))
+    # Shared by every worker process on the host; set empty for a per-process limiter
+    CTGOV_RATE_LIMIT_DB = os.getenv(
+        'CTGOV_RATE_LIMIT_DB', os.path.join(tempfile.gettempdir(), 'ctgov_rate_limit.sqlite')
+    )
+
+# Calculate date three months AGO (not ahead); the initial lookback for incremental sync
+three_months_ago = (datetime.now() - timedelta(days=90)).strftime('%Y-%m-%d')
 
 # Update search expression to include date range and proper v2 syntax
 SEARCH_EXPRESSION = "Gastrointestinal"
 
-FIELDS_TO_EXTRACT = [
-    'protocolSection.identificationModule.nctId',
-    'protocolSection.identificationModule.briefTitle',
-    'protocolSection.identificationModule.officialTitle',
-    'protocolSection.statusModule.overallStatus',
-    'protocolSection.statusModule.startDateStruct.date',
-    'protocolSection.statusModule.completionDateStruct.date',
-    'protocolSection.conditionsModule.conditions',
-    'protocolSection.designModule.phases',
-    'protocolSection.designModule.studyType',
-    'protocolSection.outcomesModule.primaryOutcomes',
-    'protocolSection.outcomesModule.secondaryOutcomes',
-    'protocolSection.eligibilityModule.eligibilityCriteria',
-    'protocolSection.contactsLocationsModule',  # Gets all contact info
-    'protocolSection.sponsorCollaboratorsModule'  # Gets sponsor info
-]
-
 SEARCH_KEYWORDS = ["Gastrointestinal"]
\ No newline at end of file
@@ -0,0 +1,91 @@
+from data_extractor import get_accessor
+
+SENIOR_ROLES = ('PRINCIPAL_INVESTIGATOR', 'STUDY_DIRECTOR')
+
+get_nct_id = get_accessor('protocolSection.identificationModule.nctId')
+
+def normalize_email(email):
+    """Lowercased, trimmed email, or None for missing and 'No email' placeholders"""
+    if not isinstance(email, str):
+        return None
+    email = email.strip().lower()
+    if not email or email == 'no email' or '@' not in email:
+        return None
+    return email
+
+def contact_key(contact):
+    """(normalized email, lowercased name) identifying one person"""
+    name = contact.get('name') or ''
+    return normalize_email(contact.get('email')), name.strip().lower() if isinstance(name, str) else ''
+
+def is_better_contact(candidate, best):
+    """Prefer contacts with site information, then contacts in senior roles"""
+    if candidate.get('site') and not best.get('site'):
+        return True
+    return candidate.get('role') in SENIOR_ROLES and best.get('role') not in SENIOR_ROLES
+
+class StudyIndex:
+    """Studies keyed by NCT ID"""
+    def __init__(self, studies=()):
+        self.studies = {}
+        for study in studies:
+            self.add(study)
+
+    def add(self, study):
+        nct_id = get_nct_id(study)
+        if nct_id:
+            self.studies[nct_id] = study
+        return nct_id
+
+    def get(self, nct_id):
+        return self.studies.get(nct_id)
+
+    def __contains__(self, nct_id):
+        return nct_id in self.studies
+
+    def __len__(self):
+        return len(self.studies)
+
+class ContactIndex:
+    """
+    Contacts indexed by NCT ID, normalized email and (email, name) in a
+    single pass. The best record for each (email, name) is kept up to date
+    as contacts are added, so no lookup rescans the contacts.
+    """
+    def __init__(self):
+        self.by_study = {}
+        self.by_email = {}
+        self.best = {}
+        self.pairs = set()
+
+    def add(self, nct_id, contact):
+        """
+        Index a contact listed on a study. Returns False if the contact has
+        no usable email or this email was already indexed for the study.
+        """
+        key = contact_key(contact)
+        email = key[0]
+        if email is None or (nct_id, email) in self.pairs:
+            return False
+
+        self.pairs.add((nct_id, email))
+        self.by_study.setdefault(nct_id, []).append(contact)
+        self.by_email.setdefault(email, []).append((nct_id, contact))
+
+        best = self.best.get(key)
+        if best is None or is_better_contact(contact, best):
+            self.best[key] = contact
+        return True
+
+    def contacts_for_study(self, nct_id):
+        return self.by_study.get(nct_id, [])
+
+    def studies_for_email(self, email):
+        return [nct_id for nct_id, _ in self.by_email.get(normalize_email(email), [])]
+
+    def get_best_contact(self, contact):
+        """Most complete record of the person this contact refers to"""
+        return self.best.get(contact_key(contact))
+
+    def __len__(self):
+        return len(self.best)
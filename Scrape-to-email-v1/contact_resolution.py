@@ -0,0 +1,147 @@
+import hashlib
+import logging
+import re
+import unicodedata
+from contact_index import is_better_contact, normalize_email
+
+# Titles and degrees dropped before comparing names
+NAME_AFFIXES = {
+    'dr', 'prof', 'professor', 'mr', 'mrs', 'ms', 'md', 'phd', 'do', 'mph', 'msc',
+    'mba', 'rn', 'bsn', 'msn', 'np', 'pa', 'pharmd', 'frcp', 'facp', 'facg', 'agaf', 'jr', 'sr'
+}
+
+ROLE_RANK = {
+    'PRINCIPAL_INVESTIGATOR': 3,
+    'STUDY_DIRECTOR': 3,
+    'STUDY_CHAIR': 3,
+    'SUB_INVESTIGATOR': 2,
+    'CONTACT': 1
+}
+
+def normalize_name(name):
+    """Lowercase ASCII 'first ... last' with titles, degrees and punctuation removed"""
+    if not isinstance(name, str):
+        return ''
+    name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode('ascii').lower()
+    # "Smith, John, MD" -> "john smith"
+    parts = [part.strip() for part in name.split(',')]
+    if len(parts) > 1 and parts[1] and parts[1].replace('.', '').strip() not in NAME_AFFIXES:
+        parts = [parts[1], parts[0]] + parts[2:]
+    tokens = re.sub(r"[^a-z\s-]", ' ', ' '.join(parts)).split()
+    return ' '.join(token for token in tokens if token not in NAME_AFFIXES)
+
+def hashed_key(*parts):
+    return hashlib.blake2b('\x1f'.join(parts).encode('utf-8'), digest_size=8).digest()
+
+def email_domain(email):
+    return email.rsplit('@', 1)[1] if email else None
+
+class Person:
+    """One resolved individual and every study they are listed on"""
+    def __init__(self):
+        self.names = set()
+        self.emails = set()
+        self.study_ids = []
+        self.contacts = []
+        self.best_contact = None
+        self.role_rank = 0
+
+    def add(self, nct_id, contact):
+        if nct_id not in self.study_ids:
+            self.study_ids.append(nct_id)
+        self.contacts.append((nct_id, contact))
+        name = normalize_name(contact.get('name'))
+        if name:
+            self.names.add(name)
+        email = normalize_email(contact.get('email'))
+        if email:
+            self.emails.add(email)
+
+        rank = ROLE_RANK.get(contact.get('role'), 1)
+        self.role_rank = max(self.role_rank, rank)
+        if self.best_contact is None or is_better_contact(contact, self.best_contact[1]):
+            self.best_contact = (nct_id, contact)
+
+    @property
+    def email(self):
+        return normalize_email(self.best_contact[1].get('email')) or min(self.emails, default=None)
+
+    def to_dict(self):
+        nct_id, contact = self.best_contact
+        return {
+            'email': self.email,
+            'names': sorted(self.names),
+            'emails': sorted(self.emails),
+            'study_ids': self.study_ids,
+            'primary_study_id': nct_id,
+            'best_contact': contact,
+            'role_rank': self.role_rank
+        }
+
+class ContactResolver:
+    """
+    Merge contact records from many studies into people. Records are
+    blocked by hashed normalized email and by hashed (last name, first
+    initial); only records sharing a block are compared, and matches are
+    merged with union-find. Two records match when they share an email, or
+    when their full normalized names agree and their emails do not
+    contradict it (one is missing or both are on the same domain).
+    """
+    def __init__(self):
+        self.records = []
+        self.parent = []
+        self.email_blocks = {}
+        self.name_blocks = {}
+
+    def find(self, i):
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, i, j):
+        root_i, root_j = self.find(i), self.find(j)
+        if root_i != root_j:
+            self.parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    def add(self, nct_id, contact):
+        email = normalize_email(contact.get('email'))
+        name = normalize_name(contact.get('name'))
+        if not email and not name:
+            return
+
+        i = len(self.records)
+        self.records.append((nct_id, contact, email, name))
+        self.parent.append(i)
+
+        if email:
+            first = self.email_blocks.setdefault(hashed_key('email', email), i)
+            if first != i:
+                self.union(first, i)
+
+        tokens = name.split()
+        if len(tokens) >= 2:
+            block = self.name_blocks.setdefault(hashed_key('name', tokens[-1], tokens[0][0]), [])
+            for j in block:
+                _, _, other_email, other_name = self.records[j]
+                if other_name != name:
+                    continue
+                if not email or not other_email or email_domain(email) == email_domain(other_email):
+                    self.union(j, i)
+            block.append(i)
+
+    def resolve(self):
+        """Return the resolved people, in order of first appearance"""
+        people = {}
+        for i, (nct_id, contact, _, _) in enumerate(self.records):
+            people.setdefault(self.find(i), Person()).add(nct_id, contact)
+
+        logging.info(f"Resolved {len(self.records)} contact records into {len(people)} people")
+        return list(people.values())
+
+def resolve_contacts(pairs):
+    """Resolve an iterable of (nct_id, contact) pairs into people"""
+    resolver = ContactResolver()
+    for nct_id, contact in pairs:
+        resolver.add(nct_id, contact)
+    return resolver.resolve()
@@ -1,40 +1,102 @@
+from projection import declare_paths
+
+# Output field -> (dotted path under the study, default when missing)
+EXTRACTION_SPEC = {
+    # Key identifiers
+    'nct_id': ('protocolSection.identificationModule.nctId', None),
+    'brief_title': ('protocolSection.identificationModule.briefTitle', None),
+    'official_title': ('protocolSection.identificationModule.officialTitle', None),
+
+    # Status info
+    'status': ('protocolSection.statusModule.overallStatus', None),
+    'phase': ('protocolSection.designModule.phases', []),
+    'study_type': ('protocolSection.designModule.studyType', None),
+
+    # Dates
+    'start_date': ('protocolSection.statusModule.startDateStruct.date', None),
+    'completion_date': ('protocolSection.statusModule.completionDateStruct.date', None),
+
+    # Study details
+    'conditions': ('protocolSection.conditionsModule.conditions', []),
+    'enrollment': ('protocolSection.designModule.enrollmentInfo.count', None),
+    'eligibility_criteria': ('protocolSection.eligibilityModule.eligibilityCriteria', None),
+
+    # Outcomes
+    'primary_outcomes': ('protocolSection.outcomesModule.primaryOutcomes', []),
+    'secondary_outcomes': ('protocolSection.outcomesModule.secondaryOutcomes', []),
+
+    # Contact info
+    'sponsor': ('protocolSection.sponsorCollaboratorsModule.leadSponsor.name', None),
+    'central_contacts': ('protocolSection.contactsLocationsModule.centralContacts', []),
+    'locations': ('protocolSection.contactsLocationsModule.locations', [])
+}
+
+declare_paths('data_extractor', [path for path, _ in EXTRACTION_SPEC.values()])
+
+_EMPTY = {}
+
+def compile_spec(spec):
+    """
+    Build one function that extracts every field of {output name: (dotted
+    path, default)} from a study. Paths are split once here; each shared
+    module prefix is looked up once per study, and missing modules fall
+    back to a shared empty dict instead of allocating one per lookup.
+    """
+    nodes = {'': 0}
+    steps = []
+    fields = []
+    for name, (path, default) in spec.items():
+        keys = path.split('.')
+        for depth in range(1, len(keys)):
+            prefix = '.'.join(keys[:depth])
+            if prefix not in nodes:
+                nodes[prefix] = len(nodes)
+                steps.append((nodes['.'.join(keys[:depth - 1])], keys[depth - 1]))
+        fields.append((name, nodes['.'.join(keys[:-1])], keys[-1], default))
+    steps, fields = tuple(steps), tuple(fields)
+    mutable = tuple((name, default) for name, _, _, default in fields if isinstance(default, (list, dict)))
+
+    def extract(study):
+        resolved = [study]
+        for parent, key in steps:
+            resolved.append(resolved[parent].get(key) or _EMPTY)
+        record = {name: resolved[parent].get(key, default) for name, parent, key, default in fields}
+        # Records never share a mutable default
+        for name, default in mutable:
+            if record[name] is default:
+                record[name] = default.copy()
+        return record
+    return extract
+
+def get_accessor(path, default=None):
+    """Return a function reading one dotted path from a study"""
+    keys = path.split('.')
+    parents, last = tuple(keys[:-1]), keys[-1]
+    mutable = isinstance(default, (list, dict))
+
+    def access(study):
+        for key in parents:
+            study = study.get(key) or _EMPTY
+        value = study.get(last, default)
+        if mutable and value is default:
+            return default.copy()
+        return value
+    return access
+
+def unwrap_studies(studies):
+    """Accept a studies list or iterator, a v2 page, or the legacy StudyFieldsResponse wrapper"""
+    if isinstance(studies, dict):
+        if 'StudyFieldsResponse' in studies:
+            return studies['StudyFieldsResponse'].get('StudyFields') or []
+        return studies.get('studies') or []
+    return studies or []
+
+extract_study = compile_spec(EXTRACTION_SPEC)
+
+def iter_extracted(studies):
+    """Lazily extract fields from each study in a list, iterator or response wrapper"""
+    return map(extract_study, unwrap_studies(studies))
+
 def extract_fields(studies):
     """Extract relevant fields from study data"""
-    extracted_data = []
-    
-    for study in studies:
-        protocol = study.get('protocolSection', {})
-        
-        study_data = {
-            # Key identifiers
-            'nct_id': protocol.get('identificationModule', {}).get('nctId'),
-            'brief_title': protocol.get('identificationModule', {}).get('briefTitle'),
-            'official_title': protocol.get('identificationModule', {}).get('officialTitle'),
-            
-            # Status info
-            'status': protocol.get('statusModule', {}).get('overallStatus'),
-            'phase': protocol.get('designModule', {}).get('phases', []),
-            'study_type': protocol.get('designModule', {}).get('studyType'),
-            
-            # Dates
-            'start_date': protocol.get('statusModule', {}).get('startDateStruct', {}).get('date'),
-            'completion_date': protocol.get('statusModule', {}).get('completionDateStruct', {}).get('date'),
-            
-            # Study details
-            'conditions': protocol.get('conditionsModule', {}).get('conditions', []),
-            'enrollment': protocol.get('designModule', {}).get('enrollmentInfo', {}).get('count'),
-            'eligibility_criteria': protocol.get('eligibilityModule', {}).get('eligibilityCriteria'),
-            
-            # Outcomes 
-            'primary_outcomes': protocol.get('outcomesModule', {}).get('primaryOutcomes', []),
-            'secondary_outcomes': protocol.get('outcomesModule', {}).get('secondaryOutcomes', []),
-            
-            # Contact info
-            'sponsor': protocol.get('sponsorCollaboratorsModule', {}).get('leadSponsor', {}).get('name'),
-            'central_contacts': protocol.get('contactsLocationsModule', {}).get('centralContacts', []),
-            'locations': protocol.get('contactsLocationsModule', {}).get('locations', [])
-        }
-        
-        extracted_data.append(study_data)
-            
-    return extracted_data
\ No newline at end of file
+    return list(iter_extracted(studies))
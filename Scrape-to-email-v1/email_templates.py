@@ -0,0 +1,109 @@
+from jinja2 import DictLoader, Environment, StrictUndefined
+
+# Deterministic emails rendered from extracted study fields, used where an
+# LLM call is not worth it (low-priority contacts) or not possible (budget
+# exhausted, circuit open). Same company context as the generate_emails prompt.
+TEMPLATES = {
+    'sponsor_subject': "Vexa Research - Automated Patient Recruitment for {{ phase }} {{ condition }} Study",
+    'sponsor_body': """Dear {{ sponsor or 'Study Sponsor' }} team,
+
+I am reaching out about {{ title }} ({{ nct_id }}), your {{ phase }} study in {{ condition }}{% if status %}, currently listed as {{ status }}{% endif %}.
+
+Vexa Research LLC builds a Patient Recruitment Automation System that helps sponsors fill enrollment faster without adding work for their sites. The system integrates with site EHRs, screens patient records against your inclusion and exclusion criteria automatically, and surfaces likely candidates to site staff for review. Every step is HIPAA compliant and patient data stays secure within the site's environment.
+
+For a {{ phase }} {{ condition }} trial, that means fewer screen failures, less manual chart review for coordinators, and a steadier flow of qualified patients across every participating site. Sponsors we work with use it to keep enrollment on schedule and to spot under-performing sites early.
+
+I would welcome the chance to show you how this could support {{ nct_id }}. Would you be open to a short call in the coming weeks?
+
+Best regards,
+Vexa Research LLC
+Andrew@VexaResearch.com
+(703) 915-4673""",
+    'investigator_subject': "Vexa Research - Patient Recruitment Solution for {{ nct_id }}",
+    'investigator_body': """Dear {{ contact_name or 'Investigator' }},
+
+I am writing about {{ title }} ({{ nct_id }}), the {{ phase }} study in {{ condition }} that your site is part of.
+
+Vexa Research LLC offers a Patient Recruitment Automation System built for research sites. It connects to your EHR, screens patient records against the study's inclusion and exclusion criteria automatically, and gives your team a ranked list of likely candidates to review. It is fully HIPAA compliant, and patient data never leaves your secure environment.
+
+For investigators and coordinators this removes most of the manual chart review behind each referral, shortens screening time, and reduces screen failures, so your team can spend its time on enrolled patients rather than on searching for them.
+
+I would be glad to walk you through a short demo tailored to your site and to how {{ nct_id }} is run there. Would you be open to a brief conversation?
+
+Best regards,
+Vexa Research LLC
+Andrew@VexaResearch.com
+(703) 915-4673""",
+    'outreach': """Subject: Streamline Patient Screening for {{ institution_short or 'Your Site' }}
+
+Hello{% if contact_name %} {{ contact_name }}{% endif %},
+
+I am reaching out from Vexa Research about a tool that streamlines patient screening for clinical trials. It matches patient records against inclusion and exclusion criteria automatically, saving your team hours of manual chart review.
+
+Sites working in {{ condition }} with large candidate pools have used it to cut screening time significantly while keeping their focus on the patients most likely to qualify.
+
+We would be happy to offer a free demo tailored to {{ institution or 'your site' }}, showing how it fits into your existing workflow.
+
+Would you be open to a quick call?
+
+Best regards,
+Dhruv Patel
+Chief Marketing Officer
+Vexa Research
+dhruv@vexaresearch.com
+(703) 915-4673
+www.vexaresearch.com"""
+}
+
+# Templates are compiled once here; rendering never touches the network
+_env = Environment(loader=DictLoader(TEMPLATES), undefined=StrictUndefined, keep_trailing_newline=False)
+_compiled = {name: _env.get_template(name) for name in TEMPLATES}
+
+def format_phase(phases):
+    """['PHASE2', 'PHASE3'] -> 'Phase 2/3'"""
+    numbers = [phase.replace('PHASE', '') for phase in phases or [] if phase.startswith('PHASE')]
+    if numbers:
+        return 'Phase ' + '/'.join(numbers)
+    return 'clinical'
+
+def study_context(nct_id=None, brief_title=None, phases=None, conditions=None, status=None, sponsor=None):
+    conditions = list(conditions or [])
+    return {
+        'nct_id': nct_id or 'your study',
+        'title': brief_title or 'your study',
+        'phase': format_phase(phases),
+        'condition': conditions[0] if conditions else 'your therapeutic area',
+        'status': (status or '').replace('_', ' ').lower(),
+        'sponsor': sponsor
+    }
+
+def render(name, **context):
+    return _compiled[name].render(**context)
+
+def render_study_email(recipient_type, context, contact_name=None):
+    """Render the sponsor or investigator email for a study_context(); returns subject and body"""
+    return {
+        'subject': render(f"{recipient_type}_subject", **context),
+        'body': render(f"{recipient_type}_body", contact_name=contact_name, **context)
+    }
+
+def render_study_emails(context):
+    """Both emails for a study in the shape StudyProcessor.format_emails expects"""
+    emails = {}
+    for recipient_type in ('sponsor', 'investigator'):
+        email = render_study_email(recipient_type, context)
+        email['targeting_notes'] = 'Rendered from template'
+        emails[f"{recipient_type}_email"] = email
+    return emails
+
+def render_outreach_email(conditions, contact):
+    """Outreach email text ('Subject: ...' line first) for one study contact"""
+    institution = contact.get('affiliation') or contact.get('site') or ''
+    conditions = list(conditions or [])
+    return render(
+        'outreach',
+        contact_name=contact.get('name'),
+        institution=institution,
+        institution_short=institution.split(',')[0],
+        condition=conditions[0] if conditions else 'your therapeutic area'
+    )
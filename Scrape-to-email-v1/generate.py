@@ -1,11 +1,12 @@
 # generate.py
 from flask import Blueprint, jsonify, current_app
 import logging
-from api_client import fetch_all_studies
-from data_extractor import extract_fields
+from api_client import fetch_all_studies, fetch_study
 from storage import DataStorage
 from study_processor import StudyProcessor
-from config import FIELDS_TO_EXTRACT
+from config import SEARCH_EXPRESSION, Config
+from projection import plan_fields
+from utils.sse import event_stream
 
 gi_bp = Blueprint('gi', __name__)
 storage = DataStorage()
@@ -27,9 +28,9 @@ def fetch_gi_studies():
         processor = StudyProcessor(config)
         
         # Fetch and process
-        studies = fetch_all_studies(FIELDS_TO_EXTRACT)
-        extracted_data = extract_fields(studies)
-        processed_data = processor.process_studies(extracted_data)
+        fields = plan_fields('study_processor', 'study_clustering')
+        studies = fetch_all_studies(fields, search_query={'condition': SEARCH_EXPRESSION})
+        processed_data = processor.process_studies(studies, batch=Config.LLM_BATCH_GENERATION)
         
         # Save results
         storage.save_data(processed_data, 'gi_studies.json')
@@ -41,4 +42,25 @@ def fetch_gi_studies():
         
     except Exception as e:
         logging.error(f"An error occurred: {str(e)}", exc_info=True)
-        return jsonify({"error": str(e)}), 500
\ No newline at end of file
+        return jsonify({"error": str(e)}), 500
+
+@gi_bp.route('/stream_emails/<nct_id>', methods=['GET'])
+def stream_study_emails(nct_id):
+    """Stream partial sponsor/investigator email drafts for one study as server-sent events"""
+    config = {
+        'AZURE_OPENAI_KEY': current_app.config['AZURE_OPENAI_KEY'],
+        'AZURE_OPENAI_ENDPOINT': current_app.config['AZURE_OPENAI_ENDPOINT'],
+        'AZURE_OPENAI_VERSION': current_app.config['AZURE_OPENAI_VERSION'],
+        'AZURE_OPENAI_DEPLOYMENT': current_app.config['AZURE_OPENAI_DEPLOYMENT']
+    }
+
+    def events():
+        try:
+            study = fetch_study(nct_id, plan_fields('study_processor'))
+        except Exception as e:
+            logging.error(f"Failed to fetch study {nct_id}: {str(e)}", exc_info=True)
+            yield 'error', str(e)
+            return
+        yield from StudyProcessor(config).stream_study(study)
+
+    return event_stream(events())
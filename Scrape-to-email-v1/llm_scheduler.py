@@ -0,0 +1,91 @@
+import heapq
+import itertools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from config import Config
+from utils.rate_limiter import token_limiter
+
+def freshness_score(date_string):
+    """Ordinal of a registry date ('YYYY-MM-DD' or 'YYYY-MM'), 0 when missing"""
+    if not date_string:
+        return 0
+    try:
+        if len(date_string) == 7:
+            date_string += '-01'
+        return date.fromisoformat(date_string[:10]).toordinal()
+    except ValueError:
+        return 0
+
+class PriorityScheduler:
+    """
+    Runs LLM work in priority order, then freshest study first. Items are
+    admitted against the token limiter one at a time from a heap, so under
+    a tight tokens-per-minute budget the highest-value work always gets
+    capacity first. With spend_cap set, items whose estimated tokens would
+    push the run's spend past the cap are skipped rather than sent.
+
+    The worker is called as worker(payload, reservation) and should
+    reconcile the reservation with the response's usage.
+    """
+    def __init__(self, endpoint, rate_limiter=None, spend_cap=None):
+        self.endpoint = endpoint
+        self.rate_limiter = rate_limiter or token_limiter
+        self.spend_cap = Config.LLM_RUN_TOKEN_CAP if spend_cap is None else spend_cap
+        self.heap = []
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+        self.spent = 0
+        self.skipped = []
+
+    def submit(self, payload, tokens, priority=0, freshness=0):
+        heapq.heappush(self.heap, (-priority, -freshness, next(self.counter), tokens, payload))
+
+    def __len__(self):
+        return len(self.heap)
+
+    def run(self, worker, max_workers=None):
+        """
+        Drain the queue and return [(payload, result)] in admission order.
+        Failed items get a None result; skipped payloads are in .skipped.
+        """
+        max_workers = max(1, max_workers or Config.LLM_MAX_WORKERS)
+        # Admit no further ahead than the workers can run, so reservations
+        # are taken in priority order just before each call is made
+        slots = threading.Semaphore(max_workers)
+        admitted = []
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while self.heap:
+                _, _, _, tokens, payload = heapq.heappop(self.heap)
+                with self.lock:
+                    over_cap = self.spend_cap and self.spent + tokens > self.spend_cap
+                    if not over_cap:
+                        self.spent += tokens
+                if over_cap:
+                    self.skipped.append(payload)
+                    continue
+
+                slots.acquire()
+                reservation = self.rate_limiter.acquire(self.endpoint, tokens)
+                admitted.append((payload, executor.submit(self.run_item, worker, payload, tokens, reservation, slots)))
+
+        results = [(payload, future.result()) for payload, future in admitted]
+        logging.info(
+            f"Scheduler ran {len(results)} {self.endpoint} items using ~{self.spent} tokens"
+            + (f", skipped {len(self.skipped)} over the {self.spend_cap} token cap" if self.skipped else "")
+        )
+        return results
+
+    def run_item(self, worker, payload, tokens, reservation, slots):
+        try:
+            return worker(payload, reservation)
+        except Exception as e:
+            logging.error(f"Scheduled {self.endpoint} item failed: {str(e)}", exc_info=True)
+            return None
+        finally:
+            # Charge the run for what the call actually used once it is reconciled
+            with self.lock:
+                self.spent += reservation.tokens - tokens
+            slots.release()
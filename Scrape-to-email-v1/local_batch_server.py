@@ -0,0 +1,164 @@
+# local_batch_server.py
+"""
+Stand-in for the Azure OpenAI files and batches endpoints, for exercising
+batch mode without a real deployment:
+
+    python local_batch_server.py --port 8085
+    AZURE_BATCH_ENDPOINT=http://127.0.0.1:8085 flask generate-offline
+
+Batches report in_progress for a couple of polls, then complete with a
+completion for every request produced by the responder.
+"""
+import argparse
+import itertools
+import json
+import logging
+import re
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import default as default_policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+POLLS_BEFORE_COMPLETE = 2
+
+def sample_email_responder(body):
+    """Answer a generate_emails prompt with valid emails for the NCT ID it mentions"""
+    prompt = body['messages'][-1]['content']
+    match = re.search(r'"nctId": "([^"]+)"', prompt)
+    nct_id = match.group(1) if match else 'unknown'
+    text = (f"Vexa Research can help recruit patients for {nct_id}. " * 10).strip()
+    email = {'subject': f"Vexa Research - Patient Recruitment for {nct_id}", 'body': text, 'targeting_notes': 'Local stand-in'}
+    content = json.dumps({'sponsor_email': email, 'investigator_email': email})
+    return {
+        'object': 'chat.completion',
+        'model': body.get('model'),
+        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+        'usage': {'prompt_tokens': len(prompt) // 4, 'completion_tokens': len(content) // 4}
+    }
+
+class BatchState:
+    def __init__(self, responder):
+        self.responder = responder
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.files = {}
+        self.batches = {}
+        self.polls = {}
+
+    def add_file(self, content, purpose):
+        with self.lock:
+            file_id = f"file-{next(self.ids)}"
+            self.files[file_id] = content
+        return {'id': file_id, 'object': 'file', 'purpose': purpose, 'bytes': len(content), 'status': 'processed'}
+
+    def create_batch(self, request):
+        with self.lock:
+            batch_id = f"batch-{next(self.ids)}"
+            lines = [line for line in self.files[request['input_file_id']].decode('utf-8').splitlines() if line.strip()]
+            self.batches[batch_id] = {
+                'id': batch_id,
+                'object': 'batch',
+                'endpoint': request.get('endpoint'),
+                'input_file_id': request['input_file_id'],
+                'status': 'validating',
+                'created_at': int(time.time()),
+                'output_file_id': None,
+                'error_file_id': None,
+                'request_counts': {'total': len(lines), 'completed': 0, 'failed': 0}
+            }
+            self.polls[batch_id] = 0
+            return dict(self.batches[batch_id])
+
+    def poll_batch(self, batch_id):
+        with self.lock:
+            batch = self.batches[batch_id]
+            self.polls[batch_id] += 1
+            if batch['status'] not in ('completed', 'failed') and self.polls[batch_id] > POLLS_BEFORE_COMPLETE:
+                self.complete(batch)
+            elif batch['status'] == 'validating':
+                batch['status'] = 'in_progress'
+            return dict(batch)
+
+    def complete(self, batch):
+        output = []
+        for line in self.files[batch['input_file_id']].decode('utf-8').splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            try:
+                body = self.responder(request['body'])
+                output.append({'custom_id': request['custom_id'], 'response': {'status_code': 200, 'body': body}, 'error': None})
+                batch['request_counts']['completed'] += 1
+            except Exception as e:
+                output.append({'custom_id': request['custom_id'], 'response': None, 'error': {'message': str(e)}})
+                batch['request_counts']['failed'] += 1
+
+        file_id = f"file-{next(self.ids)}"
+        self.files[file_id] = ''.join(json.dumps(record) + '\n' for record in output).encode('utf-8')
+        batch['output_file_id'] = file_id
+        batch['status'] = 'completed'
+
+def make_handler(state):
+    class BatchHandler(BaseHTTPRequestHandler):
+        def send_json(self, data, status=200):
+            body = json.dumps(data).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def read_body(self):
+            return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        def do_POST(self):
+            path = self.path.split('?', 1)[0]
+            if path == '/openai/files':
+                message = BytesParser(policy=default_policy).parsebytes(
+                    f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode('utf-8') + self.read_body()
+                )
+                fields = {part.get_param('name', header='content-disposition'): part.get_payload(decode=True)
+                          for part in message.iter_parts()}
+                self.send_json(state.add_file(fields.get('file', b''), (fields.get('purpose') or b'batch').decode('utf-8')))
+            elif path == '/openai/batches':
+                self.send_json(state.create_batch(json.loads(self.read_body())))
+            else:
+                self.send_json({'error': {'message': f"Unknown path {path}"}}, 404)
+
+        def do_GET(self):
+            path = self.path.split('?', 1)[0]
+            parts = path.strip('/').split('/')
+            if len(parts) == 3 and parts[:2] == ['openai', 'batches'] and parts[2] in state.batches:
+                self.send_json(state.poll_batch(parts[2]))
+            elif len(parts) == 4 and parts[:2] == ['openai', 'files'] and parts[3] == 'content' and parts[2] in state.files:
+                content = state.files[parts[2]]
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/jsonl')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+            else:
+                self.send_json({'error': {'message': f"Unknown path {path}"}}, 404)
+
+        def log_message(self, format, *args):
+            logging.debug(f"Local batch server: {format % args}")
+
+    return BatchHandler
+
+def start_server(port=0, responder=sample_email_responder, host='127.0.0.1'):
+    """Serve in a background thread; returns (server, base_url). Call server.shutdown() when done."""
+    server = ThreadingHTTPServer((host, port), make_handler(BatchState(responder)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local stand-in for the Azure OpenAI batch endpoints')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8085)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(BatchState(sample_email_responder)))
+    logging.info(f"Local batch server listening on http://{args.host}:{args.port}")
+    server.serve_forever()
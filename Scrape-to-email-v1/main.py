@@ -1,9 +1,12 @@
 import logging
-from api_client import fetch_all_studies
-from data_extractor import extract_fields
+from api_client import iter_study_pages
+from records import iter_records
 from email_generator import generate_email_content
 from email_exporter import EmailExporter
-from config import SEARCH_KEYWORDS, FIELDS_TO_EXTRACT
+from study_sync import commit_sync, sync_studies
+from config import SEARCH_KEYWORDS
+from projection import plan_fields
+from utils.retry import reset_retry_budget
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -12,38 +15,55 @@ class StudyManager:
         self.config = config
         self.email_exporter = EmailExporter()
 
-    def fetch_and_store_data(self):
+    def fetch_and_store_data(self, incremental=False):
+        """
+        Generate emails for every study matching SEARCH_KEYWORDS, or with
+        incremental=True only for studies changed since the last sync.
+        """
+        reset_retry_budget()
         try:
             for keyword in SEARCH_KEYWORDS:
                 logging.info(f"Fetching studies for keyword: {keyword}")
-                
-                # Fetch and extract
-                studies = fetch_all_studies(FIELDS_TO_EXTRACT)
-                extracted_data = extract_fields({
-                    'StudyFieldsResponse': {'StudyFields': studies}
-                })
-                
-                # Generate emails
+                search_query = {'condition': keyword}
+
+                pending_sync = None
+                if incremental:
+                    fields = plan_fields('data_extractor', 'study_sync')
+                    changed, pending_sync = sync_studies(fields, search_query)
+                    pages = [changed]
+                else:
+                    fields = plan_fields('data_extractor')
+                    pages = iter_study_pages(fields, search_query=search_query)
+
+                # Fetch, extract and generate emails one page at a time
                 emails = {"sponsors": [], "investigators": []}
-                for study in extracted_data:
-                    sponsor_email = generate_email_content(study, "sponsor")
-                    investigator_email = generate_email_content(study, "investigator")
-                    
-                    if sponsor_email:
-                        emails["sponsors"].append({
-                            "email": study.get('LeadSponsorEmail', 'sponsor@example.com'),
-                            "content": sponsor_email
-                        })
-                    
-                    if investigator_email:
-                        emails["investigators"].append({
-                            "email": study.get('OverallOfficialEmail', 'investigator@example.com'),
-                            "content": investigator_email
-                        })
+                for studies in pages:
+                    for study in iter_records(studies):
+                        sponsor_email = generate_email_content(study, "sponsor")
+                        investigator_email = generate_email_content(study, "investigator")
+
+                        if sponsor_email:
+                            emails["sponsors"].append({
+                                "email": study.get('LeadSponsorEmail', 'sponsor@example.com'),
+                                "content": sponsor_email
+                            })
+
+                        if investigator_email:
+                            emails["investigators"].append({
+                                "email": study.get('OverallOfficialEmail', 'investigator@example.com'),
+                                "content": investigator_email
+                            })
                 
                 # Export emails to a JSON file
-                filename = f"{keyword.replace(' ', '_')}_emails.json"
-                self.email_exporter.save_emails(emails, filename)
+                suffix = '_delta' if incremental else ''
+                filename = f"{keyword.replace(' ', '_')}{suffix}_emails.json"
+                saved = self.email_exporter.save_emails(emails, filename)
+
+                # Only advance the sync once this keyword's emails are safely exported
+                if pending_sync and saved:
+                    commit_sync(pending_sync)
+                elif pending_sync:
+                    logging.warning(f"Not committing sync for {keyword}; changed studies will be retried next run")
                 
                 logging.info(f"Emails generated and saved for keyword: {keyword}")
                 
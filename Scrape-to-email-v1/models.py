@@ -39,18 +39,18 @@ COMPANY CONTEXT:
 - Contact: Andrew@VexaResearch.com, (703) 915-4673
 
 OUTPUT FORMAT:
-{
-    "sponsor_email": {
+{{
+    "sponsor_email": {{
         "subject": "Vexa Research - Automated Patient Recruitment for [Trial Phase] [Condition] Study",
         "body": "[Email Body]",
         "targeting_notes": "[Notes about email targeting strategy]"
-    },
-    "investigator_email": {
+    }},
+    "investigator_email": {{
         "subject": "Vexa Research - Patient Recruitment Solution for [Study ID]",
         "body": "[Email Body]",
         "targeting_notes": "[Notes about email targeting strategy]"
-    }
-}
+    }}
+}}
 
 REQUIREMENTS:
 1. Use study phase, condition, and NCT ID from the study data
@@ -60,6 +60,47 @@ REQUIREMENTS:
 5. Include contact information in signature
 """,
                 "description": "Generates Vexa Research-branded emails for sponsors and investigators"
+            },
+            "generate_emails_batch": {
+                "name": "generate_emails_batch",
+                "prompt_text": """Generate two professional emails for each of the following {count} clinical trials:
+
+STUDIES:
+{studies_data}
+
+COMPANY CONTEXT:
+- Company: Vexa Research LLC
+- Core Service: Patient Recruitment Automation System
+- Value Proposition: Streamlined, technology-driven patient recruitment with HIPAA compliance
+- Key Features: EHR integration, automated screening, secure data handling
+- Contact: Andrew@VexaResearch.com, (703) 915-4673
+
+OUTPUT FORMAT:
+Return only a JSON array with exactly one object per study, in the same order as STUDIES:
+[
+    {{
+        "nctId": "[NCT ID of the study]",
+        "sponsor_email": {{
+            "subject": "Vexa Research - Automated Patient Recruitment for [Trial Phase] [Condition] Study",
+            "body": "[Email Body]",
+            "targeting_notes": "[Notes about email targeting strategy]"
+        }},
+        "investigator_email": {{
+            "subject": "Vexa Research - Patient Recruitment Solution for [Study ID]",
+            "body": "[Email Body]",
+            "targeting_notes": "[Notes about email targeting strategy]"
+        }}
+    }}
+]
+
+REQUIREMENTS:
+1. Use each study's phase, condition, and NCT ID from its own study data only
+2. Minimum 200 words per email body
+3. Focus on relevant study details and recruitment capabilities
+4. Maintain professional tone
+5. Include contact information in signature
+""",
+                "description": "Generates sponsor and investigator emails for several studies in one request"
             }
         }
         self.rubrics = {
@@ -0,0 +1,62 @@
+import logging
+
+# Consumer name -> dotted study paths that consumer reads
+CONSUMER_PATHS = {}
+
+class ProjectionError(ValueError):
+    """Raised when a consumer reads a path the query did not project"""
+
+def declare_paths(consumer, paths):
+    """Register the dotted study paths a consumer reads"""
+    CONSUMER_PATHS.setdefault(consumer, set()).update(paths)
+
+def covers(field, path):
+    """True if projecting field returns path, i.e. field is path or one of its ancestors"""
+    return path == field or path.startswith(field + '.')
+
+def plan_fields(*consumers):
+    """
+    Compute the minimal fields= list for a query feeding the given
+    consumers: the union of their declared paths, minus any path already
+    returned by a projected ancestor.
+    """
+    paths = set()
+    for consumer in consumers:
+        if consumer not in CONSUMER_PATHS:
+            raise ProjectionError(f"Consumer {consumer} has not declared its paths")
+        paths.update(CONSUMER_PATHS[consumer])
+
+    fields = [
+        path for path in sorted(paths)
+        if not any(other != path and covers(other, path) for other in paths)
+    ]
+    logging.debug(f"Planned projection for {', '.join(consumers)}: {fields}")
+    return fields
+
+def project_study(study, fields):
+    """Keep only the given dotted fields of a study, as the API's fields= parameter would"""
+    projected = {}
+    for field in fields:
+        parts = field.split('.')
+        value = study
+        for part in parts:
+            if not isinstance(value, dict) or part not in value:
+                break
+            value = value[part]
+        else:
+            target = projected
+            for part in parts[:-1]:
+                target = target.setdefault(part, {})
+            target[parts[-1]] = value
+    return projected
+
+def check_projection(fields, *consumers):
+    """Fail fast if any consumer reads a path that fields does not project"""
+    for consumer in consumers:
+        missing = [
+            path for path in sorted(CONSUMER_PATHS.get(consumer, ()))
+            if not any(covers(field, path) for field in fields)
+        ]
+        if missing:
+            raise ProjectionError(f"Consumer {consumer} reads unprojected paths: {', '.join(missing)}")
+    return fields
@@ -0,0 +1,156 @@
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from api_client import MAX_PAGE_SIZE, count_studies, iter_study_pages, rate_limiter
+from config import Config
+from data_extractor import get_accessor
+
+get_nct_id = get_accessor('protocolSection.identificationModule.nctId')
+
+_DONE = object()
+
+def split_or_expression(expr):
+    """Split an Essie expression on its top-level OR operators"""
+    terms = []
+    current = []
+    depth = 0
+    in_quotes = False
+    i = 0
+
+    while i < len(expr):
+        char = expr[i]
+        if char == '"' and (i == 0 or expr[i - 1] != '\\'):
+            in_quotes = not in_quotes
+        elif not in_quotes and char == '(':
+            depth += 1
+        elif not in_quotes and char == ')':
+            depth -= 1
+        elif not in_quotes and depth == 0 and expr.startswith(' OR ', i):
+            terms.append(''.join(current).strip())
+            current = []
+            i += len(' OR ')
+            continue
+        current.append(char)
+        i += 1
+
+    terms.append(''.join(current).strip())
+    return [term for term in terms if term]
+
+def plan_shards(search_query, max_workers=None):
+    """
+    Split a compound condition query into at most max_workers shards,
+    balancing them by each term's countTotal.
+    """
+    max_workers = max_workers or Config.CTGOV_FANOUT_WORKERS
+    terms = split_or_expression(search_query.get('condition', ''))
+    if len(terms) <= 1:
+        return [dict(search_query)]
+
+    def count_term(term):
+        return count_studies({**search_query, 'condition': term})
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        counts = list(executor.map(count_term, terms))
+
+    # Longest-first greedy packing keeps shard sizes close to each other
+    shard_count = min(max_workers, len(terms))
+    shards = [{'terms': [], 'count': 0} for _ in range(shard_count)]
+    for term, count in sorted(zip(terms, counts), key=lambda pair: pair[1], reverse=True):
+        if count == 0:
+            continue
+        smallest = min(shards, key=lambda shard: shard['count'])
+        smallest['terms'].append(term)
+        smallest['count'] += count
+
+    planned = []
+    for shard in shards:
+        if not shard['terms']:
+            continue
+        logging.info(f"Planned shard with {len(shard['terms'])} conditions and ~{shard['count']} studies")
+        planned.append({**search_query, 'condition': ' OR '.join(shard['terms'])})
+    return planned
+
+def iter_sharded_studies(fields_to_extract, search_query, max_workers=None, max_studies=None):
+    """
+    Fetch a compound condition query as parallel shards and yield the merged
+    studies, dropping duplicates by NCT ID. All shards draw on the shared
+    api_client rate limiter. A max_studies that fits in one page is
+    fetched as a single query, without counting terms.
+    """
+    max_workers = max_workers or Config.CTGOV_FANOUT_WORKERS
+    if max_studies is not None and max_studies <= 0:
+        return
+
+    if max_studies is not None and max_studies <= MAX_PAGE_SIZE:
+        shards = [dict(search_query)]
+    else:
+        shards = plan_shards(search_query, max_workers)
+    if not shards:
+        return
+    # No shard needs more than max_studies, since the merge stops there
+    page_size = min(MAX_PAGE_SIZE, max_studies or MAX_PAGE_SIZE)
+
+    pages = queue.Queue(maxsize=max_workers * 2)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def run_shard(shard):
+        try:
+            for page in iter_study_pages(fields_to_extract, shard, page_size=page_size, max_studies=max_studies):
+                if not put(page):
+                    return
+        except Exception as e:
+            put(e)
+        finally:
+            put(_DONE)
+
+    seen_ids = set()
+    yielded = 0
+    duplicates = 0
+    executor = ThreadPoolExecutor(max_workers=len(shards))
+    try:
+        for shard in shards:
+            executor.submit(run_shard, shard)
+
+        running = len(shards)
+        while running:
+            item = pages.get()
+            if item is _DONE:
+                running -= 1
+                continue
+            if isinstance(item, Exception):
+                raise item
+
+            for study in item:
+                nct_id = get_nct_id(study)
+                if nct_id:
+                    if nct_id in seen_ids:
+                        duplicates += 1
+                        continue
+                    seen_ids.add(nct_id)
+
+                yield study
+                yielded += 1
+                if max_studies is not None and yielded >= max_studies:
+                    return
+    finally:
+        stop.set()
+        executor.shutdown(wait=True)
+        stats = rate_limiter.get_stats()
+        logging.info(
+            f"Fan-out across {len(shards)} shards yielded {yielded} studies, dropped {duplicates} duplicates; "
+            f"rate limiter waited {stats['total_wait']:.1f}s over {stats['calls']} calls"
+        )
+
+def fetch_sharded_studies(fields_to_extract, search_query, max_workers=None, limit=None):
+    """Fetch and merge every study for a compound condition query"""
+    return list(iter_sharded_studies(fields_to_extract, search_query, max_workers, max_studies=limit))
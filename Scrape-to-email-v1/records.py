@@ -0,0 +1,169 @@
+import json
+import sys
+import zlib
+from data_extractor import extract_study, unwrap_studies
+
+# Extracted fields that are large and rarely read; stored compressed until accessed
+HEAVY_FIELDS = ('eligibility_criteria', 'primary_outcomes', 'secondary_outcomes', 'locations')
+
+def intern_value(value):
+    """Intern short repeated strings (statuses, phases, roles, countries)"""
+    return sys.intern(value) if isinstance(value, str) else value
+
+class ContactRecord:
+    """
+    One person or organization listed on a study. Behaves like the contact
+    dicts built by collect_study_contacts for get() and [] access.
+    """
+    __slots__ = (
+        'type', 'name', 'email', 'phone', 'role', 'organization', 'affiliation',
+        'site', 'city', 'state', 'country', 'nct_id'
+    )
+
+    def __init__(self, type, name=None, email=None, phone=None, role=None, organization=None,
+                 affiliation=None, site=None, city=None, state=None, country=None, nct_id=None):
+        self.type = intern_value(type)
+        self.name = name
+        self.email = email
+        self.phone = phone
+        self.role = intern_value(role)
+        self.organization = organization
+        self.affiliation = affiliation
+        self.site = site
+        self.city = city
+        self.state = intern_value(state)
+        self.country = intern_value(country)
+        self.nct_id = nct_id
+
+    @classmethod
+    def from_dict(cls, contact, type=None, nct_id=None, **extra):
+        fields = {name: contact.get(name) for name in cls.__slots__ if name in contact}
+        fields.update(extra)
+        if type is not None:
+            fields['type'] = type
+        if nct_id is not None:
+            fields['nct_id'] = nct_id
+        return cls(**fields)
+
+    def get(self, name, default=None):
+        value = getattr(self, name, None) if name in self.__slots__ else None
+        return default if value is None else value
+
+    def __getitem__(self, name):
+        if name not in self.__slots__ or getattr(self, name) is None:
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def __contains__(self, name):
+        return name in self.__slots__ and getattr(self, name) is not None
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__ if getattr(self, name) is not None}
+
+class StudyRecord:
+    """
+    Compact form of an extract_fields() result. Short repeated strings are
+    interned, list fields become tuples, and the heavy fields (eligibility
+    text, outcomes, locations) are kept as one compressed JSON blob that is
+    only decoded when one of them is read.
+    """
+    __slots__ = (
+        'nct_id', 'brief_title', 'official_title', 'status', 'phase', 'study_type',
+        'start_date', 'completion_date', 'conditions', 'enrollment', 'sponsor',
+        'central_contacts', '_heavy'
+    )
+
+    def __init__(self, data):
+        self.nct_id = data.get('nct_id')
+        self.brief_title = data.get('brief_title')
+        self.official_title = data.get('official_title')
+        self.status = intern_value(data.get('status'))
+        self.phase = tuple(intern_value(phase) for phase in data.get('phase') or ())
+        self.study_type = intern_value(data.get('study_type'))
+        self.start_date = data.get('start_date')
+        self.completion_date = data.get('completion_date')
+        self.conditions = tuple(data.get('conditions') or ())
+        self.enrollment = data.get('enrollment')
+        self.sponsor = data.get('sponsor')
+        self.central_contacts = tuple(
+            ContactRecord.from_dict(contact, type='Central Contact', nct_id=self.nct_id)
+            for contact in data.get('central_contacts') or ()
+        )
+
+        heavy = {name: data[name] for name in HEAVY_FIELDS if data.get(name)}
+        self._heavy = zlib.compress(json.dumps(heavy, separators=(',', ':')).encode('utf-8')) if heavy else None
+
+    def load_heavy(self):
+        """Decode all heavy fields at once"""
+        if self._heavy is None:
+            return {}
+        return json.loads(zlib.decompress(self._heavy))
+
+    @property
+    def eligibility_criteria(self):
+        return self.load_heavy().get('eligibility_criteria')
+
+    @property
+    def primary_outcomes(self):
+        return self.load_heavy().get('primary_outcomes', [])
+
+    @property
+    def secondary_outcomes(self):
+        return self.load_heavy().get('secondary_outcomes', [])
+
+    @property
+    def locations(self):
+        return self.load_heavy().get('locations', [])
+
+    def iter_site_contacts(self):
+        """Yield a ContactRecord for every contact listed at a study location"""
+        for location in self.locations:
+            for contact in location.get('contacts') or ():
+                yield ContactRecord.from_dict(
+                    contact,
+                    type='Site Contact',
+                    nct_id=self.nct_id,
+                    site=location.get('facility', 'Unknown Site'),
+                    city=location.get('city'),
+                    state=location.get('state'),
+                    country=location.get('country')
+                )
+
+    def get(self, name, default=None):
+        """dict-style access so records can stand in for extract_fields() output"""
+        if name not in self.__slots__ and name not in HEAVY_FIELDS or name.startswith('_'):
+            return default
+        value = getattr(self, name)
+        if value is None:
+            return default
+        return list(value) if isinstance(value, tuple) else value
+
+    def to_dict(self):
+        """Expand back to the extract_fields() dict shape"""
+        data = {
+            'nct_id': self.nct_id,
+            'brief_title': self.brief_title,
+            'official_title': self.official_title,
+            'status': self.status,
+            'phase': list(self.phase),
+            'study_type': self.study_type,
+            'start_date': self.start_date,
+            'completion_date': self.completion_date,
+            'conditions': list(self.conditions),
+            'enrollment': self.enrollment,
+            'sponsor': self.sponsor,
+            'central_contacts': [contact.to_dict() for contact in self.central_contacts]
+        }
+        heavy = self.load_heavy()
+        data['eligibility_criteria'] = heavy.get('eligibility_criteria')
+        for name in ('primary_outcomes', 'secondary_outcomes', 'locations'):
+            data[name] = heavy.get(name, [])
+        return data
+
+def iter_records(studies):
+    """Extract studies straight into StudyRecords without keeping the dicts"""
+    for study in unwrap_studies(studies):
+        yield StudyRecord(extract_study(study))
+
+def extract_records(studies):
+    return list(iter_records(studies))
@@ -1,8 +1,14 @@
 import schedule
 import time
-from generate import fetch_and_store_gi_studies
+from config import Config
+from main import StudyManager
 
-schedule.every().day.at("00:00").do(fetch_and_store_gi_studies)
+study_manager = StudyManager(Config)
+
+def nightly_sync():
+    study_manager.fetch_and_store_data(incremental=True)
+
+schedule.every().day.at("00:00").do(nightly_sync)
 
 while True:
     schedule.run_pending()
@@ -2,7 +2,7 @@
 import json
 import os
 import logging
-from typing import Any, Dict, List
+from typing import Any, Dict, Iterable, List
 
 class DataStorage:
     def __init__(self, base_dir: str = 'data'):
@@ -21,6 +21,19 @@ class DataStorage:
             logging.error(f"Error saving data to {filename}: {str(e)}")
             return False
 
+    def save_jsonl(self, records: Iterable[Any], filename: str) -> bool:
+        """Stream records to a JSON lines file, one record per line"""
+        try:
+            filepath = os.path.join(self.base_dir, filename)
+            with open(filepath, 'w') as f:
+                for record in records:
+                    f.write(json.dumps(record) + '\n')
+            logging.info(f"Data saved successfully to {filepath}")
+            return True
+        except Exception as e:
+            logging.error(f"Error saving data to {filename}: {str(e)}")
+            return False
+
     def load_data(self, filename: str) -> Any:
         """Load data from JSON file"""
         try:
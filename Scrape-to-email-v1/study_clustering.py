@@ -0,0 +1,138 @@
+import hashlib
+import logging
+import re
+from config import Config
+from data_extractor import compile_spec
+from projection import declare_paths
+
+# Study fields compared when grouping near-duplicate studies
+CLUSTER_SPEC = {
+    'nctId': ('protocolSection.identificationModule.nctId', None),
+    'briefTitle': ('protocolSection.identificationModule.briefTitle', None),
+    'phase': ('protocolSection.designModule.phases', []),
+    'condition': ('protocolSection.conditionsModule.conditions', []),
+    'sponsor': ('protocolSection.sponsorCollaboratorsModule.leadSponsor.name', None)
+}
+
+declare_paths('study_clustering', [path for path, _ in CLUSTER_SPEC.values()])
+
+extract_cluster_data = compile_spec(CLUSTER_SPEC)
+
+SIMHASH_BITS = 64
+BANDS = 8
+BAND_BITS = SIMHASH_BITS // BANDS
+
+# Title words that tell one sponsor's site, part and extension studies apart
+VARIANT_WORDS = {'site', 'sites', 'part', 'extension', 'cohort', 'substudy', 'long', 'term', 'open', 'label', 'ole', 'ii', 'iii', 'iv'}
+
+def normalize_text(text):
+    return re.sub(r'[^a-z0-9]+', ' ', (text or '').lower()).split()
+
+def title_words(title):
+    """Normalized title words without site numbers or part and extension markers"""
+    return [word for word in normalize_text(title) if not (word.isdigit() or len(word) == 1 or word in VARIANT_WORDS)]
+
+def title_features(data):
+    words = title_words(data['briefTitle'])
+    return ['w:' + word for word in words] + ['b:' + ' '.join(pair) for pair in zip(words, words[1:])]
+
+def group_key(data):
+    """Sponsor, phases and conditions, which clustered studies must share exactly"""
+    conditions = sorted(' '.join(normalize_text(condition)) for condition in data['condition'])
+    return ' '.join(normalize_text(data['sponsor'])), tuple(sorted(data['phase'])), tuple(conditions)
+
+def simhash(features):
+    totals = [0] * SIMHASH_BITS
+    for feature in features:
+        value = int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'big')
+        for bit in range(SIMHASH_BITS):
+            totals[bit] += 1 if value >> bit & 1 else -1
+    return sum(1 << bit for bit, total in enumerate(totals) if total > 0)
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+def base_only_words(base, member):
+    """Words of the base study's title missing from the member's; emails that mention one are about the base study"""
+    member_words = set(normalize_text(member['briefTitle']))
+    return {word for word in normalize_text(base['briefTitle']) if word not in member_words and (word.isdigit() or len(word) > 2)}
+
+class StudyClusterer:
+    """
+    Group near-duplicate studies, e.g. one sponsor's multi-site or
+    extension studies whose titles differ only by a suffix. Studies are
+    only compared within the same sponsor, phases and conditions; within
+    that group each title's SimHash (site, part and extension words left
+    out) is split into BANDS bands, and studies sharing a band whose
+    titles are within max_distance bits are merged with union-find.
+    Studies with no sponsor are never grouped.
+    """
+    def __init__(self, max_distance=None):
+        self.max_distance = Config.LLM_CLUSTER_MAX_DISTANCE if max_distance is None else max_distance
+        self.records = []
+        self.parent = []
+        self.exact = {}
+        self.bands = {}
+
+    def find(self, i):
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, i, j):
+        root_i, root_j = self.find(i), self.find(j)
+        if root_i != root_j:
+            self.parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    def add(self, data):
+        i = len(self.records)
+        fingerprint = simhash(title_features(data))
+        self.records.append((data, fingerprint))
+        self.parent.append(i)
+        if not data['sponsor'] or not title_words(data['briefTitle']):
+            return
+
+        # Identical titles join directly; only the first is banded
+        group = group_key(data)
+        first = self.exact.setdefault((fingerprint, group), i)
+        if first != i:
+            self.union(first, i)
+            return
+
+        for band in range(BANDS):
+            key = (group, band, fingerprint >> (band * BAND_BITS) & ((1 << BAND_BITS) - 1))
+            block = self.bands.setdefault(key, [])
+            for j in block:
+                if self.find(j) != self.find(i) and hamming_distance(fingerprint, self.records[j][1]) <= self.max_distance:
+                    self.union(j, i)
+            block.append(i)
+
+    def clusters(self):
+        """Lists of record indexes in order of first appearance; the first index represents the cluster"""
+        groups = {}
+        for i in range(len(self.records)):
+            groups.setdefault(self.find(i), []).append(i)
+        return list(groups.values())
+
+def cluster_studies(studies, max_distance=None):
+    """Cluster raw studies; returns lists of indexes into studies"""
+    clusterer = StudyClusterer(max_distance)
+    for study in studies:
+        clusterer.add(extract_cluster_data(study))
+    clusters = clusterer.clusters()
+    logging.info(f"Clustered {len(studies)} studies into {len(clusters)} groups")
+    return clusters
+
+def personalize(text, base, member):
+    """Swap a representative study's identifying fields in text for a cluster member's"""
+    if not text:
+        return text
+    replacements = [(base['nctId'], member['nctId']), (base['briefTitle'], member['briefTitle'])]
+    if base['condition'] and member['condition'] and base['condition'][0] != member['condition'][0]:
+        replacements.append((base['condition'][0], member['condition'][0]))
+    # Longest first, so a title is replaced before any shorter string inside it
+    for old, new in sorted(replacements, key=lambda pair: len(pair[0] or ''), reverse=True):
+        if old and new and old != new:
+            text = text.replace(old, new)
+    return text
@@ -1,116 +1,502 @@
-from utils.azure_config import call_azure_api
+from utils.azure_config import (
+    DEFAULT_MAX_TOKENS, DEFAULT_TEMPERATURE, call_azure_api, call_azure_api_stream, completion_timeout,
+    get_llm_cache, llm_cache_key
+)
+from utils.json_stream import IncrementalJSONAssembler
+from utils.rate_limiter import token_limiter
+from utils.token_counter import count_prompt
+from utils.azure_batch import AzureBatchClient, build_batch_line
 import logging
 import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
 from models import get_prompt
 from datetime import datetime
+from projection import declare_paths
+from data_extractor import compile_spec
+from storage import DataStorage
+from email_templates import render_study_emails, study_context
+from study_clustering import base_only_words, cluster_studies, extract_cluster_data, normalize_text, personalize
+
+# Study fields sent to the email generation prompt
+PROMPT_SPEC = {
+    'nctId': ('protocolSection.identificationModule.nctId', None),
+    'briefTitle': ('protocolSection.identificationModule.briefTitle', None),
+    'phase': ('protocolSection.designModule.phases', []),
+    'condition': ('protocolSection.conditionsModule.conditions', []),
+    'status': ('protocolSection.statusModule.overallStatus', None)
+}
+
+declare_paths('study_processor', [path for path, _ in PROMPT_SPEC.values()])
+
+extract_prompt_data = compile_spec(PROMPT_SPEC)
+
+def parse_json_content(response):
+    """Parse the JSON a completion returned, tolerating a ```json fence"""
+    content = response['choices'][0]['message']['content'].strip()
+    if content.startswith('```'):
+        content = content.split('\n', 1)[1] if '\n' in content else ''
+        content = content.rsplit('```', 1)[0]
+    return json.loads(content)
+
+def parse_emails(response):
+    return parse_json_content(response)
+
+def plan_batch_size(max_tokens=None):
+    """How many studies fit one batched request's completion budget"""
+    max_tokens = max_tokens or Config.LLM_BATCH_MAX_TOKENS
+    return max(1, min(Config.LLM_BATCH_MAX_STUDIES, max_tokens // Config.LLM_TOKENS_PER_STUDY))
 
 class StudyProcessor:
     def __init__(self, config):
         self.config = config
+        self.stats_lock = threading.Lock()
         self.processing_stats = {
             'total': 0,
             'successful': 0,
             'failed': 0,
+            'requests': 0,
+            'clustered': 0,
             'processing_log': []
         }
 
     def validate_email_content(self, emails, study):
         """Validate email content meets requirements"""
         required_fields = ['subject', 'body', 'targeting_notes']
-        
+
         for email_type in ['sponsor_email', 'investigator_email']:
             if not all(field in emails[email_type] for field in required_fields):
                 return False
-            
+
             # Validate minimum content requirements
             if len(emails[email_type]['body']) < 100:  # Arbitrary minimum length
                 return False
-                
+
             # Verify critical study info is included
             critical_fields = ['NCTId', 'BriefTitle', 'Phase']
             for field in critical_fields:
                 if field in study and study[field] not in emails[email_type]['body']:
                     return False
-                    
+
         return True
 
-    def process_study(self, study):
-        """Process single study with validation and logging"""
-        self.processing_stats['total'] += 1
-        study_id = study.get('protocolSection', {}).get('identificationModule', {}).get('nctId', 'unknown')
-        
-        try:
-            prompt_data = get_prompt("generate_emails")
-            if not prompt_data:
-                raise ValueError("Email generation prompt not found")
-
-            study_data = {
-                'nctId': study.get('protocolSection', {}).get('identificationModule', {}).get('nctId'),
-                'briefTitle': study.get('protocolSection', {}).get('identificationModule', {}).get('briefTitle'),
-                'phase': study.get('protocolSection', {}).get('designModule', {}).get('phases', []),
-                'condition': study.get('protocolSection', {}).get('conditionsModule', {}).get('conditions', []),
-                'status': study.get('protocolSection', {}).get('statusModule', {}).get('overallStatus')
+    def record_result(self, study_id, error=None):
+        with self.stats_lock:
+            entry = {
+                'study_id': study_id,
+                'status': 'failed' if error else 'success',
+                'timestamp': datetime.now().isoformat()
             }
+            if error:
+                self.processing_stats['failed'] += 1
+                entry['error'] = str(error)
+            else:
+                self.processing_stats['successful'] += 1
+            self.processing_stats['processing_log'].append(entry)
 
-            prompt_text = prompt_data["prompt_text"].format(
-                study_data=json.dumps(study_data, indent=2)
-            )
-            
-            response = call_azure_api(prompt_text, "email_generation", self.config)
-            if not response or 'choices' not in response:
-                raise ValueError("Invalid API response")
-
-            emails = json.loads(response['choices'][0]['message']['content'])
-            
-            # Validate email content
-            if not self.validate_email_content(emails, study):
-                raise ValueError("Generated emails failed validation")
-
-            # Validate email content before returning
-            if not emails or not isinstance(emails, dict):
-                raise ValueError("Invalid email format returned from API")
-
-            processed_emails = {
-                'sponsor_email': {
-                    'to': study.get('leadSponsorEmail'),
-                    'subject': emails.get('sponsor_email', {}).get('subject'),
-                    'content': emails.get('sponsor_email', {}).get('body'),
-                    'metadata': {
-                        'processed_at': datetime.now().isoformat(),
-                        'targeting_notes': emails.get('sponsor_email', {}).get('targeting_notes')
-                    }
-                },
-                'investigator_email': {
-                    'to': study.get('overallOfficialEmail'),
-                    'subject': emails.get('investigator_email', {}).get('subject'),
-                    'content': emails.get('investigator_email', {}).get('body'),
-                    'metadata': {
-                        'processed_at': datetime.now().isoformat(),
-                        'targeting_notes': emails.get('investigator_email', {}).get('targeting_notes')
-                    }
+    def format_emails(self, study, emails):
+        """Shape validated LLM output into the exported email records"""
+        return {
+            'sponsor_email': {
+                'to': study.get('leadSponsorEmail'),
+                'subject': emails.get('sponsor_email', {}).get('subject'),
+                'content': emails.get('sponsor_email', {}).get('body'),
+                'metadata': {
+                    'processed_at': datetime.now().isoformat(),
+                    'targeting_notes': emails.get('sponsor_email', {}).get('targeting_notes')
+                }
+            },
+            'investigator_email': {
+                'to': study.get('overallOfficialEmail'),
+                'subject': emails.get('investigator_email', {}).get('subject'),
+                'content': emails.get('investigator_email', {}).get('body'),
+                'metadata': {
+                    'processed_at': datetime.now().isoformat(),
+                    'targeting_notes': emails.get('investigator_email', {}).get('targeting_notes')
                 }
             }
+        }
 
-            self.processing_stats['successful'] += 1
-            self.processing_stats['processing_log'].append({
-                'study_id': study_id,
-                'status': 'success',
-                'timestamp': datetime.now().isoformat()
-            })
-            
+    def template_emails(self, study, study_data):
+        """Templated stand-in for a study whose generation failed, or None if disabled"""
+        if not Config.LLM_TEMPLATE_FALLBACK:
+            return None
+        context = study_context(
+            nct_id=study_data['nctId'],
+            brief_title=study_data['briefTitle'],
+            phases=study_data['phase'],
+            conditions=study_data['condition'],
+            status=study_data['status']
+        )
+        result = self.format_emails(study, render_study_emails(context))
+        for email in result.values():
+            email['metadata']['source'] = 'template'
+        return result
+
+    def build_email_prompt(self, study_data):
+        """Return the email generation prompt for a study and its token count"""
+        prompt_data = get_prompt("generate_emails")
+        if not prompt_data:
+            raise ValueError("Email generation prompt not found")
+
+        study_json = json.dumps(study_data, indent=2)
+        prompt_text = prompt_data["prompt_text"].format(study_data=study_json)
+        return prompt_text, count_prompt("generate_emails", study_data=study_json)
+
+    def complete_study(self, study, response):
+        """Validate one study's completion and shape it into email records"""
+        if not response or 'choices' not in response:
+            raise ValueError("Invalid API response")
+
+        emails = parse_emails(response)
+
+        # Validate email content
+        if not self.validate_email_content(emails, study):
+            raise ValueError("Generated emails failed validation")
+
+        # Validate email content before returning
+        if not emails or not isinstance(emails, dict):
+            raise ValueError("Invalid email format returned from API")
+
+        return self.format_emails(study, emails)
+
+    def process_study(self, study):
+        """Process single study with validation and logging"""
+        with self.stats_lock:
+            self.processing_stats['total'] += 1
+        study_data = extract_prompt_data(study)
+        study_id = study_data['nctId'] or 'unknown'
+
+        try:
+            prompt_text, prompt_tokens = self.build_email_prompt(study_data)
+
+            cache_if = None
+            if Config.LLM_CACHE_VALIDATED_ONLY:
+                cache_if = lambda result: self.validate_email_content(parse_emails(result), study)
+            with self.stats_lock:
+                self.processing_stats['requests'] += 1
+            response = call_azure_api(
+                prompt_text, "email_generation", self.config, cache_if=cache_if, prompt_tokens=prompt_tokens
+            )
+            processed_emails = self.complete_study(study, response)
+            self.record_result(study_id)
             return processed_emails
 
         except Exception as e:
-            self.processing_stats['failed'] += 1
-            self.processing_stats['processing_log'].append({
-                'study_id': study_id,
-                'status': 'failed',
-                'error': str(e),
-                'timestamp': datetime.now().isoformat()
-            })
+            self.record_result(study_id, e)
             logging.error(f"Failed to process study {study_id}: {str(e)}", exc_info=True)
-            return None
+            return self.template_emails(study, study_data)
+
+    def stream_study(self, study):
+        """
+        Like process_study, but streams the completion. Yields
+        ('draft', partial emails) as the JSON arrives, then a final
+        ('result', processed emails) once the whole response validates, or
+        ('error', message).
+        """
+        with self.stats_lock:
+            self.processing_stats['total'] += 1
+        study_data = extract_prompt_data(study)
+        study_id = study_data['nctId'] or 'unknown'
+
+        try:
+            prompt_text, prompt_tokens = self.build_email_prompt(study_data)
+
+            cache_if = None
+            if Config.LLM_CACHE_VALIDATED_ONLY:
+                cache_if = lambda result: self.validate_email_content(parse_emails(result), study)
+            with self.stats_lock:
+                self.processing_stats['requests'] += 1
+
+            stream = call_azure_api_stream(
+                prompt_text, "email_generation", self.config, cache_if=cache_if, prompt_tokens=prompt_tokens
+            )
+            assembler = IncrementalJSONAssembler()
+            last_draft = None
+            for fragment in stream:
+                assembler.feed(fragment)
+                draft = assembler.snapshot()
+                if draft is not None and draft != last_draft:
+                    last_draft = draft
+                    yield 'draft', draft
+
+            processed_emails = self.complete_study(study, stream.response)
+            self.record_result(study_id)
+            yield 'result', processed_emails
+
+        except Exception as e:
+            self.record_result(study_id, e)
+            logging.error(f"Failed to stream study {study_id}: {str(e)}", exc_info=True)
+            yield 'error', str(e)
+
+    def match_batch_results(self, studies, study_ids, response):
+        """
+        Pair each study in a batch with its validated emails. Returns a list
+        aligned with studies holding the emails, or None where the model's
+        answer for that study was missing or failed validation.
+        """
+        matched = [None] * len(studies)
+        try:
+            items = parse_json_content(response)
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            logging.warning(f"Could not parse batched response: {str(e)}")
+            return matched
+        if not isinstance(items, list):
+            return matched
+
+        positions = {study_id: i for i, study_id in enumerate(study_ids)}
+        for order, item in enumerate(items):
+            if not isinstance(item, dict):
+                continue
+            i = positions.get(item.get('nctId'), order if len(items) == len(studies) else None)
+            if i is None or i >= len(studies) or matched[i] is not None:
+                continue
+            try:
+                if self.validate_email_content(item, studies[i]):
+                    matched[i] = item
+            except (KeyError, TypeError):
+                continue
+        return matched
+
+    def process_batch(self, studies):
+        """
+        Generate emails for several studies in one request. Studies the
+        model answered badly are split in half and retried; a single
+        leftover study falls back to process_study. Returns results aligned
+        with studies, with None for failures.
+        """
+        if len(studies) == 1:
+            return [self.process_study(studies[0])]
+
+        prompt_data = get_prompt("generate_emails_batch")
+        if not prompt_data:
+            raise ValueError("Batched email generation prompt not found")
+
+        studies_data = [extract_prompt_data(study) for study in studies]
+        study_ids = [data['nctId'] for data in studies_data]
+        studies_json = json.dumps(studies_data, indent=2)
+        prompt_text = prompt_data["prompt_text"].format(count=len(studies), studies_data=studies_json)
+        prompt_tokens = count_prompt("generate_emails_batch", count=len(studies), studies_data=studies_json)
+
+        cache_if = None
+        if Config.LLM_CACHE_VALIDATED_ONLY:
+            cache_if = lambda result: all(self.match_batch_results(studies, study_ids, result))
+        with self.stats_lock:
+            self.processing_stats['requests'] += 1
+        response = call_azure_api(
+            prompt_text, "email_generation", self.config,
+            max_tokens=Config.LLM_BATCH_MAX_TOKENS, cache_if=cache_if, prompt_tokens=prompt_tokens,
+            timeout=completion_timeout(Config.LLM_BATCH_MAX_TOKENS)
+        )
+
+        if response and 'choices' in response:
+            matched = self.match_batch_results(studies, study_ids, response)
+        else:
+            matched = [None] * len(studies)
+
+        results = [None] * len(studies)
+        failed = []
+        for i, (study, emails) in enumerate(zip(studies, matched)):
+            if emails is None:
+                failed.append(i)
+                continue
+            with self.stats_lock:
+                self.processing_stats['total'] += 1
+            results[i] = self.format_emails(study, emails)
+            self.record_result(study_ids[i] or 'unknown')
+
+        if failed:
+            logging.info(f"Retrying {len(failed)} of {len(studies)} studies from a batched request")
+            half = (len(failed) + 1) // 2
+            for part in (failed[:half], failed[half:]):
+                if part:
+                    retried = self.process_batch([studies[i] for i in part])
+                    for i, result in zip(part, retried):
+                        results[i] = result
+        return results
+
+    def process_studies(self, studies, max_workers=None, batch=False, cluster=None):
+        """
+        Generate emails for many studies on a bounded thread pool. Each call
+        is admitted through the shared tokens-per-minute limiter; results
+        come back in input order, with None for studies that failed. With
+        batch=True studies are packed plan_batch_size() per request. With
+        cluster (LLM_CLUSTER_STUDIES by default) near-duplicate studies share
+        one generation; see process_clustered.
+        """
+        studies = list(studies)
+        if (Config.LLM_CLUSTER_STUDIES if cluster is None else cluster) and len(studies) > 1:
+            return self.process_clustered(
+                studies, lambda bases: self.process_studies(bases, max_workers, batch, cluster=False)
+            )
+        if batch:
+            size = plan_batch_size()
+            tasks = [studies[i:i + size] for i in range(0, len(studies), size)]
+            worker = self.process_batch
+        else:
+            tasks = studies
+            worker = self.process_study
+
+        max_workers = max(1, min(max_workers or Config.LLM_MAX_WORKERS, len(tasks) or 1))
+        logging.info(f"Generating emails for {len(studies)} studies in {len(tasks)} tasks with {max_workers} workers")
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(worker, tasks))
+        if batch:
+            results = [result for batch_results in results for result in batch_results]
+
+        limiter_stats = token_limiter.get_stats()
+        logging.info(
+            f"Generated emails for {sum(1 for result in results if result)} of {len(studies)} studies "
+            f"in {self.processing_stats['requests']} requests; "
+            f"token limiter waited {limiter_stats['total_wait']:.1f}s in total"
+        )
+        return results
+
+    def process_clustered(self, studies, generate):
+        """
+        Group near-duplicate studies, run generate() on one representative
+        per group, and give every other member a copy of its emails with
+        the NCT ID, title and condition swapped for the member's own.
+        Members whose copy still reads as the representative's are
+        generated on their own.
+        """
+        clusters = cluster_studies(studies)
+        bases = generate([studies[members[0]] for members in clusters])
+
+        results = [None] * len(studies)
+        rejected = []
+        for members, base in zip(clusters, bases):
+            results[members[0]] = base
+            if len(members) == 1 or base is None:
+                continue
+            base_data = extract_cluster_data(studies[members[0]])
+            for i in members[1:]:
+                results[i] = self.personalize_emails(studies[i], base, base_data)
+                if results[i] is None:
+                    rejected.append(i)
+                    continue
+                with self.stats_lock:
+                    self.processing_stats['clustered'] += 1
+
+        if rejected:
+            logging.info(f"Generating {len(rejected)} clustered studies on their own")
+            for i, result in zip(rejected, generate([studies[i] for i in rejected])):
+                results[i] = result
+        return results
+
+    def personalize_emails(self, study, base, base_data):
+        """
+        A cluster member's emails derived from its representative's, or
+        None when they still mention words only the representative's title
+        has (another drug, site or part) and cannot be reused.
+        """
+        member_data = extract_cluster_data(study)
+        if base['sponsor_email']['metadata'].get('source') == 'template':
+            return self.template_emails(study, extract_prompt_data(study))
+
+        emails = {
+            email_type: {
+                'subject': personalize(email['subject'], base_data, member_data),
+                'body': personalize(email['content'], base_data, member_data),
+                'targeting_notes': email['metadata'].get('targeting_notes')
+            }
+            for email_type, email in base.items()
+        }
+        base_words = base_only_words(base_data, member_data)
+        for email in emails.values():
+            leftover = base_words.intersection(normalize_text(email['subject']) + normalize_text(email['body']))
+            if leftover:
+                logging.info(
+                    f"Not reusing {base_data['nctId']} emails for {member_data['nctId']}: "
+                    f"they still mention {', '.join(sorted(leftover))}"
+                )
+                return None
+
+        result = self.format_emails(study, emails)
+        for email in result.values():
+            email['metadata']['source'] = 'cluster'
+            email['metadata']['cluster_base'] = base_data['nctId']
+        return result
+
+    def process_studies_offline(self, studies, client=None, filename='email_batch_input.jsonl', cluster=None):
+        """
+        Generate emails through an offline batch job instead of live calls.
+        Every uncached request is written to one JSONL file, submitted as a
+        batch, polled until done, and the results go through the same
+        validation and formatting as process_study. Returns results in
+        input order, with None for studies that failed. Near-duplicate
+        studies are clustered as in process_studies.
+        """
+        studies = list(studies)
+        if (Config.LLM_CLUSTER_STUDIES if cluster is None else cluster) and len(studies) > 1:
+            return self.process_clustered(
+                studies, lambda bases: self.process_studies_offline(bases, client, filename, cluster=False)
+            )
+        results = [None] * len(studies)
+        cache = get_llm_cache()
+        deployment = self.config['AZURE_OPENAI_DEPLOYMENT']
+        storage = DataStorage()
+        lines = []
+        pending = {}
+
+        for i, study in enumerate(studies):
+            with self.stats_lock:
+                self.processing_stats['total'] += 1
+            study_data = extract_prompt_data(study)
+            study_id = study_data['nctId'] or 'unknown'
+            try:
+                prompt_text, _ = self.build_email_prompt(study_data)
+            except Exception as e:
+                self.record_result(study_id, e)
+                continue
+
+            key = llm_cache_key(deployment, prompt_text, DEFAULT_TEMPERATURE, DEFAULT_MAX_TOKENS)
+            cached = cache.get(key) if cache else None
+            if cached is not None:
+                try:
+                    results[i] = self.complete_study(study, json.loads(cached))
+                    self.record_result(study_id)
+                    continue
+                except Exception:
+                    pass
+
+            custom_id = str(i)
+            lines.append(build_batch_line(custom_id, prompt_text, deployment, DEFAULT_MAX_TOKENS, DEFAULT_TEMPERATURE))
+            pending[custom_id] = (i, study_id, key)
+
+        if not lines:
+            return results
+
+        logging.info(f"Submitting {len(lines)} of {len(studies)} studies as an offline batch job")
+        storage.save_jsonl(lines, filename)
+        with self.stats_lock:
+            self.processing_stats['requests'] += 1
+        try:
+            responses = (client or AzureBatchClient(self.config)).run(os.path.join(storage.base_dir, filename))
+        except Exception as e:
+            logging.error(f"Offline batch job failed: {str(e)}", exc_info=True)
+            responses = {}
+
+        for custom_id, (i, study_id, key) in pending.items():
+            response = responses.get(custom_id)
+            try:
+                results[i] = self.complete_study(studies[i], response)
+                self.record_result(study_id)
+                if cache:
+                    cache.set(key, json.dumps(response).encode('utf-8'), {'deployment': deployment})
+            except Exception as e:
+                self.record_result(study_id, e)
+                logging.error(f"Failed to process study {study_id} from batch job: {str(e)}")
+                results[i] = self.template_emails(studies[i], extract_prompt_data(studies[i]))
+
+        return results
 
     def get_processing_stats(self):
         """Return processing statistics"""
-        return self.processing_stats
\ No newline at end of file
+        with self.stats_lock:
+            stats = dict(self.processing_stats)
+            stats['processing_log'] = list(self.processing_stats['processing_log'])
+        return stats
@@ -0,0 +1,102 @@
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime
+from api_client import iter_study_pages
+from config import three_months_ago
+from data_extractor import get_accessor
+from projection import check_projection, declare_paths
+from storage import DataStorage
+
+SYNC_STATE_FILE = 'sync_state.json'
+STUDY_STORE_FILE = 'studies.json'
+LAST_UPDATE_FIELD = 'protocolSection.statusModule.lastUpdatePostDateStruct.date'
+
+storage = DataStorage()
+
+declare_paths('study_sync', [
+    'protocolSection.identificationModule.nctId',
+    LAST_UPDATE_FIELD
+])
+
+def query_key(search_query):
+    """Stable key for a search query, used to keep one high-water mark per query"""
+    return hashlib.sha1(json.dumps(search_query or {}, sort_keys=True).encode('utf-8')).hexdigest()
+
+get_nct_id = get_accessor('protocolSection.identificationModule.nctId')
+get_last_update = get_accessor(LAST_UPDATE_FIELD)
+
+def build_delta_query(search_query, since):
+    """Restrict a search query to studies whose LastUpdatePostDate is on or after since"""
+    delta_query = dict(search_query or {})
+    date_filter = f"AREA[LastUpdatePostDate]RANGE[{since},MAX]"
+    if delta_query.get('advanced'):
+        delta_query['advanced'] = f"({delta_query['advanced']}) AND {date_filter}"
+    else:
+        delta_query['advanced'] = date_filter
+    return delta_query
+
+def load_or_default(filename):
+    if not os.path.exists(os.path.join(storage.base_dir, filename)):
+        return {}
+    return storage.load_data(filename) or {}
+
+def sync_studies(fields_to_extract, search_query, full=False):
+    """
+    Fetch only the studies updated since this query's high-water mark.
+    The first sync of a query (or full=True) looks back to
+    config.three_months_ago.
+
+    Returns (changed studies, pending sync). Nothing is saved here: pass
+    the pending sync to commit_sync() once the changed studies have been
+    processed, so a failed run picks the same studies up again.
+    """
+    state = load_or_default(SYNC_STATE_FILE)
+    store = load_or_default(STUDY_STORE_FILE)
+    key = query_key(search_query)
+    query_state = state.get(key, {})
+
+    since = three_months_ago if full else query_state.get('high_water_mark', three_months_ago)
+    fields = check_projection(fields_to_extract, 'study_sync')
+
+    logging.info(f"Syncing studies updated since {since}")
+    changed = {}
+    high_water_mark = query_state.get('high_water_mark')
+
+    for page in iter_study_pages(fields, build_delta_query(search_query, since)):
+        for study in page:
+            nct_id = get_nct_id(study)
+            if not nct_id:
+                continue
+
+            if store.get(nct_id) != study:
+                changed[nct_id] = study
+
+            last_update = get_last_update(study)
+            if last_update and (high_water_mark is None or last_update > high_water_mark):
+                high_water_mark = last_update
+
+    pending = {
+        'key': key,
+        'studies': changed,
+        'state': {
+            'query': search_query,
+            'high_water_mark': high_water_mark or since,
+            'synced_at': datetime.now().isoformat(),
+            'changed': len(changed)
+        }
+    }
+    logging.info(f"Found {len(changed)} new or changed studies; candidate high-water mark is {pending['state']['high_water_mark']}")
+    return list(changed.values()), pending
+
+def commit_sync(pending):
+    """Save a sync's changed studies and advance its query's high-water mark"""
+    state = load_or_default(SYNC_STATE_FILE)
+    store = load_or_default(STUDY_STORE_FILE)
+    store.update(pending['studies'])
+    state[pending['key']] = pending['state']
+
+    storage.save_data(store, STUDY_STORE_FILE)
+    storage.save_data(state, SYNC_STATE_FILE)
+    logging.info(f"Committed sync; high-water mark is now {pending['state']['high_water_mark']}")
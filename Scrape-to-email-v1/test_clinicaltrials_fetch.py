@@ -1,29 +1,31 @@
-from flask import Blueprint, current_app, jsonify
+from flask import Blueprint, current_app, jsonify, request
 import logging
 import os
-from api_client import fetch_all_studies
-from data_extractor import extract_fields
+from api_client import fetch_study, log_pushdown_savings, targeted_query
+from projection import declare_paths, plan_fields
+from query_fanout import iter_sharded_studies
+from utils.azure_config import estimate_tokens
+from utils.http_client import call_openai_with_retry, get_azure_openai_client
+from utils.rate_limiter import token_limiter
+from utils.token_counter import count_tokens
+from utils.retry import reset_retry_budget
+from utils.sse import event_stream
+from data_extractor import extract_fields, get_accessor
+from contact_index import ContactIndex, StudyIndex, normalize_email
+from contact_resolution import ContactResolver
+from email_templates import render_outreach_email
+from llm_scheduler import PriorityScheduler, freshness_score
+from study_sync import LAST_UPDATE_FIELD, get_last_update
 import json
 import openai
 from pymongo import MongoClient
+from config import Config
 from datetime import datetime
 
 test_bp = Blueprint('test', __name__)
 
 logging.basicConfig(level=logging.INFO)
 
-# Define the fields we want to extract
-FIELDS_TO_EXTRACT = [
-    "protocolSection.identificationModule",
-    "protocolSection.statusModule",
-    "protocolSection.conditionsModule", 
-    "protocolSection.designModule",
-    "protocolSection.outcomesModule",
-    "protocolSection.eligibilityModule",
-    "protocolSection.contactsLocationsModule",
-    "protocolSection.sponsorCollaboratorsModule"
-]
-
 # Update search parameters with comprehensive GI conditions
 SEARCH_QUERY = {
     "condition": (
@@ -62,17 +64,34 @@ SEARCH_QUERY = {
         'CONDITION:"Liver Cirrhosis" OR '
         'CONDITION:"Fatty Liver Disease" OR '
         'CONDITION:"Portal Hypertension"'
-    ),
-    "main": (
-        'AREA[OverallStatus]"NOT_YET_RECRUITING" AND '  # Changed to only NOT_YET_RECRUITING
-        'AREA[StudyType]"INTERVENTIONAL" AND '
-        '(AREA[Phase]"PHASE1" OR '
-        'AREA[Phase]"PHASE2" OR '
-        'AREA[Phase]"PHASE3" OR '
-        'AREA[Phase]"PHASE4")'
     )
 }
 
+# Targeting rules, pushed down as filter.* parameters so rejected studies never cross the wire
+TARGETING_RULES = {
+    'statuses': ['NOT_YET_RECRUITING'],  # Changed to only NOT_YET_RECRUITING
+    'study_types': ['INTERVENTIONAL'],
+    'phases': ['PHASE1', 'PHASE2', 'PHASE3', 'PHASE4'],
+    'require_contact_email': True
+}
+
+declare_paths('contact_collection', [
+    'protocolSection.identificationModule.nctId',
+    'protocolSection.identificationModule.briefTitle',
+    'protocolSection.sponsorCollaboratorsModule.leadSponsor',
+    'protocolSection.contactsLocationsModule.centralContacts',
+    'protocolSection.contactsLocationsModule.overallOfficials',
+    'protocolSection.contactsLocationsModule.locations'
+])
+declare_paths('evaluate_contact', ['protocolSection.designModule.phases', LAST_UPDATE_FIELD])
+declare_paths('outreach_email', ['protocolSection.conditionsModule.conditions'])
+
+# Minimal projection covering every consumer of the fetched studies
+FIELDS_TO_EXTRACT = plan_fields('contact_collection', 'evaluate_contact', 'outreach_email')
+
+get_phases = get_accessor('protocolSection.designModule.phases', [])
+get_conditions = get_accessor('protocolSection.conditionsModule.conditions', [])
+
 def evaluate_contact(contact, study_data):
     """Evaluate if and how we should contact this person"""
     
@@ -109,26 +128,20 @@ def evaluate_contact(contact, study_data):
             evaluation['priority'] += 2
 
     # Add study-specific context
-    study_phase = study_data.get('protocolSection', {}).get('designModule', {}).get('phases', [])
+    study_phase = get_phases(study_data)
     if study_phase and 'PHASE4' in study_phase:
         evaluation['priority'] += 1
         evaluation['rationale'].append("given your involvement in this Phase 4 study")
 
     return evaluation if evaluation['priority'] > 1 else None
 
-def generate_outreach_email(config, study_data, contact):
-    try:
-        client = openai.AzureOpenAI(
-            api_key=config['AZURE_OPENAI_KEY'],
-            api_version=config['AZURE_OPENAI_VERSION'],
-            azure_endpoint=config['AZURE_OPENAI_ENDPOINT']
-        )
-
-        # Extract condition names for more general reference
-        conditions = study_data.get('protocolSection', {}).get('conditionsModule', {}).get('conditions', [])
-        primary_condition = conditions[0] if conditions else "your therapeutic area"
+def build_outreach_messages(study_data, contact):
+    """Chat messages asking for one outreach email to a study contact"""
+    # Extract condition names for more general reference
+    conditions = get_conditions(study_data)
+    primary_condition = conditions[0] if conditions else "your therapeutic area"
 
-        prompt = f"""Generate a professional outreach email following this exact structure and tone:
+    prompt = f"""Generate a professional outreach email following this exact structure and tone:
 
 STUDY CONTEXT (for reference only - don't mention specific trial details):
 - Focus Area: {primary_condition}
@@ -179,18 +192,34 @@ TONE GUIDELINES:
 - Keep total length similar to template
 - No mention of specific studies or trial IDs"""
 
-        response = client.chat.completions.create(
+    return [{
+        "role": "system", 
+        "content": "You are an AI that writes highly personalized and effective outreach emails for clinical trial recruitment software sales."
+    }, {
+        "role": "user",
+        "content": prompt
+    }]
+
+def estimate_outreach_tokens(study_data, contact):
+    messages = build_outreach_messages(study_data, contact)
+    return estimate_tokens(''.join(message['content'] for message in messages), 800)
+
+def generate_outreach_email(config, study_data, contact, reservation=None):
+    """Generate one outreach email; pass reservation when the tokens were already admitted"""
+    try:
+        client = get_azure_openai_client(config)
+        messages = build_outreach_messages(study_data, contact)
+        prompt = ''.join(message['content'] for message in messages)
+
+        if reservation is None:
+            reservation = token_limiter.acquire('outreach_email', estimate_tokens(prompt, 800))
+        response = call_openai_with_retry(config, lambda: client.chat.completions.create(
             model=config['AZURE_OPENAI_DEPLOYMENT'],
-            messages=[{
-                "role": "system", 
-                "content": "You are an AI that writes highly personalized and effective outreach emails for clinical trial recruitment software sales."
-            }, {
-                "role": "user",
-                "content": prompt
-            }],
+            messages=messages,
             temperature=0.7,
             max_tokens=800
-        )
+        ))
+        token_limiter.reconcile(reservation, response.usage)
         
         return response.choices[0].message.content
 
@@ -201,27 +230,113 @@ TONE GUIDELINES:
         logging.error(f"Error generating email: {str(e)}")
         raise
 
-def get_unique_contact_key(contact):
-    """Generate a unique key for a contact based on email and name"""
-    return f"{contact.get('email', '').lower()}_{contact.get('name', '').lower()}"
-
-def get_best_contact_info(contacts, contact_key):
-    """Get the most complete contact info for a given contact key"""
-    matching_contacts = [c for c in contacts if get_unique_contact_key(c) == contact_key]
-    if not matching_contacts:
-        return None
-        
-    # Prioritize contacts with more information
-    best_contact = matching_contacts[0]
-    for contact in matching_contacts[1:]:
-        # Prefer contacts with site/organization info
-        if contact.get('site') and not best_contact.get('site'):
-            best_contact = contact
-        # Prefer contacts with higher roles
-        elif contact.get('role') in ['PRINCIPAL_INVESTIGATOR', 'STUDY_DIRECTOR'] and best_contact.get('role') not in ['PRINCIPAL_INVESTIGATOR', 'STUDY_DIRECTOR']:
-            best_contact = contact
+def stream_outreach_email(config, study_data, contact):
+    """Yield the outreach email text as it is generated"""
+    client = get_azure_openai_client(config)
+    messages = build_outreach_messages(study_data, contact)
+    prompt = ''.join(message['content'] for message in messages)
+
+    reservation = token_limiter.acquire('outreach_email', estimate_tokens(prompt, 800))
+    stream = call_openai_with_retry(config, lambda: client.chat.completions.create(
+        model=config['AZURE_OPENAI_DEPLOYMENT'],
+        messages=messages,
+        temperature=0.7,
+        max_tokens=800,
+        stream=True
+    ))
+    parts = []
+    try:
+        for chunk in stream:
+            for choice in chunk.choices:
+                if choice.delta and choice.delta.content:
+                    parts.append(choice.delta.content)
+                    yield choice.delta.content
+    finally:
+        token_limiter.reconcile(reservation, tokens=count_tokens(prompt) + count_tokens(''.join(parts)))
+
+def split_email(email_content):
+    """Split generated email text into (subject, body)"""
+    content_parts = email_content.split('\n', 1)
+    if len(content_parts) == 2:
+        return content_parts[0].replace('Subject:', '').strip(), content_parts[1].strip()
+    return "", ""
+
+def collect_study_contacts(study):
+    """Collect every sponsor, central, official and site contact listed on a study"""
+    print(f"\nAnalyzing study structure for {study.get('protocolSection', {}).get('identificationModule', {}).get('nctId', 'N/A')}")
+    
+    study_info = {
+        'nct_id': study.get('protocolSection', {}).get('identificationModule', {}).get('nctId', 'N/A'),
+        'title': study.get('protocolSection', {}).get('identificationModule', {}).get('briefTitle', 'N/A'),
+        'contacts': []
+    }
+    
+    # Get all possible contact sources
+    protocol = study.get('protocolSection', {})
+    contacts_module = protocol.get('contactsLocationsModule', {})
+    sponsor_module = protocol.get('sponsorCollaboratorsModule', {})
+    
+    print(f"Available modules:")
+    print(f"- Contacts module found: {'contactsLocationsModule' in protocol}")
+    print(f"- Sponsor module found: {'sponsorCollaboratorsModule' in protocol}")
+
+    # Lead sponsor contacts
+    if sponsor_module:
+        lead_sponsor = sponsor_module.get('leadSponsor', {})
+        if lead_sponsor:
+            study_info['contacts'].append({
+                'type': 'Lead Sponsor',
+                'name': lead_sponsor.get('name', 'No name'),
+                'organization': lead_sponsor.get('name'),
+                'email': lead_sponsor.get('email', 'No email'),
+                'phone': lead_sponsor.get('phone', 'No phone')
+            })
+    
+    # Central contacts
+    for contact in contacts_module.get('centralContacts', []):
+        study_info['contacts'].append({
+            'type': 'Central Contact',
+            'name': contact.get('name', 'No name'),
+            'email': contact.get('email', 'No email'),
+            'phone': contact.get('phone', 'No phone'),
+            'role': contact.get('role', 'No role')
+        })
+    
+    # Overall officials/investigators
+    for official in contacts_module.get('overallOfficials', []):
+        study_info['contacts'].append({
+            'type': 'Overall Official',
+            'name': official.get('name', 'No name'),
+            'email': official.get('email', 'No email'),
+            'phone': official.get('phone', 'No phone'),
+            'role': official.get('role', 'No role'),
+            'affiliation': official.get('affiliation', 'No affiliation')
+        })
             
-    return best_contact
+    # Location contacts
+    for location in contacts_module.get('locations', []):
+        if location.get('contacts'):
+            for contact in location.get('contacts', []):
+                study_info['contacts'].append({
+                    'type': 'Site Contact',
+                    'name': contact.get('name', 'No name'),
+                    'email': contact.get('email', 'No email'),
+                    'phone': contact.get('phone', 'No phone'),
+                    'role': contact.get('role', 'No role'),
+                    'site': location.get('facility', 'Unknown Site'),  # Changed this line
+                    'city': location.get('city'),
+                    'state': location.get('state'),
+                    'country': location.get('country')
+                })
+
+    # Print debug info about what we found
+    print(f"\nFound {len(study_info['contacts'])} contacts:")
+    for contact in study_info['contacts']:
+        print(f"- {contact['type']}: {contact['name']}")
+        if contact.get('email'): print(f"  Email: {contact['email']}")
+        if contact.get('phone'): print(f"  Phone: {contact['phone']}")
+
+    return study_info
 
 # Add MongoDB connection setup
 def get_mongo_client():
@@ -238,28 +353,27 @@ def check_study_contacted(db, study_id, email):
         'email': email
     }) is not None
 
-def get_study_by_id(studies, study_id):
-    """Helper function to find a study by its ID"""
-    for study in studies:
-        if study.get('protocolSection', {}).get('identificationModule', {}).get('nctId') == study_id:
-            return study
-    return None
+def get_contacted_emails(db, study_id):
+    """Normalized emails already contacted for a study, in one query"""
+    collection = db.contacted_studies
+    return {
+        normalize_email(record.get('email'))
+        for record in collection.find({'study_id': study_id}, {'email': 1})
+    }
 
-def record_study_contact(db, study_id, email, contact_info, study_data):
+def record_study_contact(db, study_id, email, contact_info, study_data, email_content=None):
     """Record that we've contacted this study"""
     collection = db.contacted_studies
     
     # Parse email content if it exists in contact_info
-    email_content = generate_outreach_email(current_app.config, study_data, contact_info)
+    if email_content is None:
+        email_content = generate_outreach_email(current_app.config, study_data, contact_info)
     subject_line = ""
     body_content = ""
     
     if email_content:
         # Split email content into subject and body
-        content_parts = email_content.split('\n', 1)
-        if len(content_parts) == 2:
-            subject_line = content_parts[0].replace('Subject:', '').strip()
-            body_content = content_parts[1].strip()
+        subject_line, body_content = split_email(email_content)
     
     contact_record = {
         'study_id': study_id,
@@ -291,179 +405,136 @@ def test_clinical_trials_fetch():
         }
         
         logging.info("Starting clinical trials fetch test...")
+        reset_retry_budget()
         
-        # 1. Fetch raw data from ClinicalTrials.gov
+        # Initialize MongoDB connection
+        mongo_client = get_mongo_client()
+        db = mongo_client.VexaMarketing
+
+        # 1. Stream studies from ClinicalTrials.gov as parallel condition shards
         logging.info("Fetching studies from ClinicalTrials.gov...")
-        raw_studies = fetch_all_studies(
-            FIELDS_TO_EXTRACT, 
-            search_query=SEARCH_QUERY,
-            limit=30  # Changed from 1 to 30
-        )
-        logging.info(f"Retrieved {len(raw_studies)} studies")
-
-        # Export full study details for debugging
-        if raw_studies:
-            first_study = raw_studies[0]
-            with open(os.path.join(output_dir, 'study_debug.txt'), 'w') as f:
-                json.dump(first_study, f, indent=2)
-            print(f"\nFull details of first study exported to {output_dir}/study_debug.txt")
-            
-        # 2. Extract fields - Fix data structure
-        extracted_data = []
-        if raw_studies:
-            for study in raw_studies:
-                # Ensure study is in correct format
-                if isinstance(study, dict) and 'protocolSection' in study:
-                    extracted_data.append(study)
-                else:
-                    logging.warning(f"Skipping malformed study data: {study}")
-        
-        # 3. Process and display contact information
+        limit = request.args.get('limit', 30, type=int)  # 0 walks the whole result set
+        studies_seen = 0
+
         print("\nContact Information from Studies:")
         print("-" * 50)
-        
+
         contact_data = []
-        
-        for study in extracted_data:
-            # Debug print study structure
-            print(f"\nAnalyzing study structure for {study.get('protocolSection', {}).get('identificationModule', {}).get('nctId', 'N/A')}")
-            
-            study_info = {
-                'nct_id': study.get('protocolSection', {}).get('identificationModule', {}).get('nctId', 'N/A'),
-                'title': study.get('protocolSection', {}).get('identificationModule', {}).get('briefTitle', 'N/A'),
-                'contacts': []
-            }
-            
-            # Get all possible contact sources
-            protocol = study.get('protocolSection', {})
-            contacts_module = protocol.get('contactsLocationsModule', {})
-            sponsor_module = protocol.get('sponsorCollaboratorsModule', {})
-            oversight_module = protocol.get('oversightModule', {})
-            
-            print(f"Available modules:")
-            print(f"- Contacts module found: {'contactsLocationsModule' in protocol}")
-            print(f"- Sponsor module found: {'sponsorCollaboratorsModule' in protocol}")
-            print(f"- Oversight module found: {'oversightModule' in protocol}")
-
-            # Lead sponsor contacts
-            if sponsor_module:
-                lead_sponsor = sponsor_module.get('leadSponsor', {})
-                if lead_sponsor:
-                    study_info['contacts'].append({
-                        'type': 'Lead Sponsor',
-                        'name': lead_sponsor.get('name', 'No name'),
-                        'organization': lead_sponsor.get('name'),
-                        'email': lead_sponsor.get('email', 'No email'),
-                        'phone': lead_sponsor.get('phone', 'No phone')
-                    })
-            
-            # Central contacts
-            for contact in contacts_module.get('centralContacts', []):
-                study_info['contacts'].append({
-                    'type': 'Central Contact',
-                    'name': contact.get('name', 'No name'),
-                    'email': contact.get('email', 'No email'),
-                    'phone': contact.get('phone', 'No phone'),
-                    'role': contact.get('role', 'No role')
-                })
-            
-            # Overall officials/investigators
-            for official in contacts_module.get('overallOfficials', []):
-                study_info['contacts'].append({
-                    'type': 'Overall Official',
-                    'name': official.get('name', 'No name'),
-                    'email': official.get('email', 'No email'),
-                    'phone': official.get('phone', 'No phone'),
-                    'role': official.get('role', 'No role'),
-                    'affiliation': official.get('affiliation', 'No affiliation')
-                })
-                    
-            # Location contacts
-            for location in contacts_module.get('locations', []):
-                if location.get('contacts'):
-                    for contact in location.get('contacts', []):
-                        study_info['contacts'].append({
-                            'type': 'Site Contact',
-                            'name': contact.get('name', 'No name'),
-                            'email': contact.get('email', 'No email'),
-                            'phone': contact.get('phone', 'No phone'),
-                            'role': contact.get('role', 'No role'),
-                            'site': location.get('facility', 'Unknown Site'),  # Changed this line
-                            'city': location.get('city'),
-                            'state': location.get('state'),
-                            'country': location.get('country')
-                        })
-
-            # Print debug info about what we found
-            print(f"\nFound {len(study_info['contacts'])} contacts:")
+        emails = []
+        # Studies and contacts indexed as they stream in
+        study_index = StudyIndex()
+        contact_index = ContactIndex()
+        resolver = ContactResolver()
+
+        pushed_query = targeted_query(SEARCH_QUERY, TARGETING_RULES)
+        for study in iter_sharded_studies(FIELDS_TO_EXTRACT, pushed_query, max_studies=limit or None):
+            studies_seen += 1
+
+            # Export full study details for debugging
+            if studies_seen == 1:
+                with open(os.path.join(output_dir, 'study_debug.txt'), 'w') as f:
+                    json.dump(study, f, indent=2)
+                print(f"\nFull details of first study exported to {output_dir}/study_debug.txt")
+
+            # 2. Ensure study is in correct format
+            if not (isinstance(study, dict) and 'protocolSection' in study):
+                logging.warning(f"Skipping malformed study data: {study}")
+                continue
+
+            # 3. Process and display contact information
+            study_info = collect_study_contacts(study)
+            if not study_info['contacts']:
+                continue
+            contact_data.append(study_info)
+
+            study_id = study_index.add(study)
+
+            # Skip if we can't get a study ID
+            if not study_id:
+                continue
+
+            contacted_emails = get_contacted_emails(db, study_id)
             for contact in study_info['contacts']:
-                print(f"- {contact['type']}: {contact['name']}")
-                if contact.get('email'): print(f"  Email: {contact['email']}")
-                if contact.get('phone'): print(f"  Phone: {contact['phone']}")
+                # Skip contacts without email and repeats within this study
+                if not contact_index.add(study_id, contact):
+                    continue
+
+                # Check if we've already contacted this study/email combination
+                if normalize_email(contact['email']) in contacted_emails:
+                    logging.info(f"Skipping already contacted study/email: {study_id}/{contact['email']}")
+                    continue
 
-            if study_info['contacts']:
-                contact_data.append(study_info)
+                resolver.add(study_id, contact)
+
+        logging.info(f"Retrieved {studies_seen} studies with {len(contact_index)} unique contacts")
+
+        # Queue one email per resolved person, most valuable contacts and freshest studies first.
+        # Low-priority contacts get a templated email instead of an LLM call.
+        scheduler = PriorityScheduler('outreach_email', spend_cap=request.args.get('token_cap', type=int))
+        templated = []
+        for person in resolver.resolve():
+            if not person.email:
+                continue
+            primary_study_id, contact = person.best_contact
+            study_data = study_index.get(primary_study_id)
+            evaluations = [evaluate_contact(study_contact, study_index.get(study_id))
+                           for study_id, study_contact in person.contacts]
+            priority = max((evaluation['priority'] for evaluation in evaluations if evaluation), default=0)
+            if priority < Config.LLM_MIN_CONTACT_PRIORITY:
+                templated.append(person)
+                continue
+            scheduler.submit(
+                person,
+                estimate_outreach_tokens(study_data, contact),
+                priority=priority,
+                freshness=freshness_score(get_last_update(study_data))
+            )
+
+        def send_person_email(person, reservation):
+            primary_study_id, contact = person.best_contact
+            return generate_outreach_email(config, study_index.get(primary_study_id), contact, reservation)
+
+        outcomes = []
+        for person, email_content in scheduler.run(send_person_email):
+            if email_content is not None:
+                outcomes.append((person, email_content, 'llm'))
+            elif Config.LLM_TEMPLATE_FALLBACK:
+                templated.append(person)
+        # Contacts over the run's token cap fall back to a template as well
+        if Config.LLM_TEMPLATE_FALLBACK:
+            templated.extend(scheduler.skipped)
+        for person in templated:
+            primary_study_id, contact = person.best_contact
+            email_content = render_outreach_email(get_conditions(study_index.get(primary_study_id)), contact)
+            outcomes.append((person, email_content, 'template'))
+
+        for person, email_content, source in outcomes:
+            primary_study_id, contact = person.best_contact
+            emails.append({
+                "contact": contact,
+                "email_content": email_content,
+                "source": source,
+                "study_id": primary_study_id,
+                "study_ids": person.study_ids
+            })
+
+            # Record every study this person is listed on so none is contacted again
+            for study_id, study_contact in person.contacts:
+                record_study_contact(
+                    db, study_id, study_contact['email'], study_contact,
+                    study_index.get(study_id), email_content=email_content
+                )
+                processed_study_ids.add(study_id)
+
+        log_pushdown_savings(SEARCH_QUERY, pushed_query)
 
         # 4. Save contact information to file
         with open(os.path.join(output_dir, 'study_contacts.json'), 'w') as f:
             json.dump(contact_data, f, indent=2)
         print(f"\nContact information saved to {output_dir}/study_contacts.json")
         print(f"Total studies with contact information: {len(contact_data)}")
-        
-        # Initialize MongoDB connection
-        mongo_client = get_mongo_client()
-        db = mongo_client.VexaMarketing
-        
-        emails = []
-        if raw_studies and len(contact_data) > 0:
-            # Track already processed study/email combinations
-            processed_contacts = set()
-            
-            for study in raw_studies:
-                study_id = study.get('protocolSection', {}).get('identificationModule', {}).get('nctId')
-                
-                # Skip if we can't get a study ID
-                if not study_id:
-                    continue
-                
-                study_contacts = []
-                for contact_info in contact_data:
-                    if contact_info['nct_id'] == study_id:
-                        for contact in contact_info['contacts']:
-                            # Skip contacts without email
-                            if contact.get('email', 'No email') == 'No email':
-                                continue
-                                
-                            # Create unique contact identifier
-                            contact_key = f"{study_id}_{contact['email']}"
-                            
-                            # Skip if we've already processed this contact
-                            if contact_key in processed_contacts:
-                                continue
-                                
-                            # Check if we've already contacted this study/email combination
-                            if check_study_contacted(db, study_id, contact['email']):
-                                logging.info(f"Skipping already contacted study/email: {study_id}/{contact['email']}")
-                                continue
-                            
-                            processed_contacts.add(contact_key)
-                            study_contacts.append(contact)
-                
-                if study_contacts:
-                    # Generate emails for unique contacts
-                    for contact in study_contacts:
-                        email_content = generate_outreach_email(config, study, contact)
-                        emails.append({
-                            "contact": contact,
-                            "email_content": email_content,
-                            "study_id": study_id
-                        })
-                        
-                        # Record this contact in MongoDB - now passing the full study object
-                        record_study_contact(db, study_id, contact['email'], contact, study)
-                    
-                    processed_study_ids.add(study_id)
-            
+
+        if contact_data:
             # Save generated emails
             with open(os.path.join(output_dir, 'generated_emails.json'), 'w') as f:
                 json.dump(emails, f, indent=2)
@@ -475,7 +546,7 @@ def test_clinical_trials_fetch():
         # Always return a response, even if no emails were generated
         return jsonify({
             'status': 'success',
-            'message': f"Successfully processed {len(raw_studies)} studies",
+            'message': f"Successfully processed {studies_seen} studies",
             'contacts_found': len(contact_data),
             'emails_generated': len(emails),
             'output_files': {
@@ -492,6 +563,46 @@ def test_clinical_trials_fetch():
             'message': str(e)
         }), 500
 
+@test_bp.route('/stream_outreach/<nct_id>', methods=['GET'])
+def stream_outreach(nct_id):
+    """Stream an outreach email draft for a study's best contact as server-sent events"""
+    config = {
+        'AZURE_OPENAI_KEY': current_app.config['AZURE_OPENAI_KEY'],
+        'AZURE_OPENAI_ENDPOINT': current_app.config['AZURE_OPENAI_ENDPOINT'],
+        'AZURE_OPENAI_VERSION': current_app.config['AZURE_OPENAI_VERSION'],
+        'AZURE_OPENAI_DEPLOYMENT': current_app.config['AZURE_OPENAI_DEPLOYMENT']
+    }
+
+    def events():
+        try:
+            study = fetch_study(nct_id, FIELDS_TO_EXTRACT)
+            contact_index = ContactIndex()
+            for contact in collect_study_contacts(study)['contacts']:
+                contact_index.add(nct_id, contact)
+            contacts = contact_index.contacts_for_study(nct_id)
+            if not contacts:
+                yield 'error', {'message': f"No contact with an email found for {nct_id}"}
+                return
+
+            contact = contact_index.get_best_contact(contacts[0])
+            yield 'contact', contact
+
+            parts = []
+            for fragment in stream_outreach_email(config, study, contact):
+                parts.append(fragment)
+                yield 'draft', {'content': ''.join(parts)}
+
+            subject_line, body_content = split_email(''.join(parts))
+            if not subject_line or not body_content:
+                yield 'error', {'message': "Generated email is missing a subject or body"}
+                return
+            yield 'result', {'subject': subject_line, 'body': body_content, 'contact': contact}
+        except Exception as e:
+            logging.error(f"Error streaming outreach email for {nct_id}: {str(e)}", exc_info=True)
+            yield 'error', {'message': str(e)}
+
+    return event_stream(events())
+
 @test_bp.route('/test_mongo', methods=['GET'])
 def test_mongo_connection():
     """Test route to verify MongoDB connection and study tracking"""
@@ -1,13 +1,16 @@
 from flask import Blueprint, request, jsonify, current_app
 import logging
-from utils.azure_config import call_azure_api
+from utils.azure_config import call_azure_api, call_azure_api_stream
+from utils.json_stream import IncrementalJSONAssembler
+from utils.sse import event_stream
 import json
-from utils.rate_limiter import AdaptiveRateLimiter
+from utils.rate_limiter import token_limiter
+from utils.token_counter import count_prompt
 from models import get_prompt
 
 upload_bp = Blueprint('upload', __name__)
 
-def generate_question_summary(content, config, rate_limiter):
+def generate_question_summary(content, config, rate_limiter=token_limiter):
     prompt_data = get_prompt("generate_question_summary")
     if not prompt_data:
         raise ValueError("Prompt not found")
@@ -17,11 +20,59 @@ def generate_question_summary(content, config, rate_limiter):
 
     summary_prompt = prompt_text.format(content=content)
 
-    rate_limiter.add_request('summary', summary_prompt)
-    response = call_azure_api(summary_prompt, "summary", config)
+    response = call_azure_api(
+        summary_prompt, "summary", config, rate_limiter=rate_limiter,
+        prompt_tokens=count_prompt("generate_question_summary", content=content)
+    )
     
     if response and 'choices' in response and response['choices']:
         summary_content = response['choices'][0]['message']['content']
         return json.loads(summary_content)
     else:
         raise ValueError("Failed to generate summary")
+
+
+def stream_question_summary(content, config, rate_limiter=token_limiter):
+    """
+    Streaming variant of generate_question_summary. Yields ('draft',
+    partial summary) as the JSON arrives and a final ('result', summary)
+    once the complete response parses, or ('error', message).
+    """
+    try:
+        prompt_data = get_prompt("generate_question_summary")
+        if not prompt_data:
+            raise ValueError("Prompt not found")
+
+        summary_prompt = prompt_data["regular_prompt"].format(content=content)
+
+        stream = call_azure_api_stream(
+            summary_prompt, "summary", config, rate_limiter=rate_limiter,
+            prompt_tokens=count_prompt("generate_question_summary", content=content)
+        )
+        assembler = IncrementalJSONAssembler()
+        last_draft = None
+        for fragment in stream:
+            assembler.feed(fragment)
+            draft = assembler.snapshot()
+            if draft is not None and draft != last_draft:
+                last_draft = draft
+                yield 'draft', draft
+        yield 'result', assembler.result()
+    except Exception as e:
+        logging.error(f"Failed to stream summary: {str(e)}", exc_info=True)
+        yield 'error', str(e)
+
+@upload_bp.route('/summary_stream', methods=['POST'])
+def summary_stream():
+    """Stream a structured summary of the posted content as server-sent events"""
+    content = (request.get_json(silent=True) or {}).get('content') or request.form.get('content')
+    if not content:
+        return jsonify({'error': 'content is required'}), 400
+
+    config = {
+        'AZURE_OPENAI_KEY': current_app.config['AZURE_OPENAI_KEY'],
+        'AZURE_OPENAI_ENDPOINT': current_app.config['AZURE_OPENAI_ENDPOINT'],
+        'AZURE_OPENAI_VERSION': current_app.config['AZURE_OPENAI_VERSION'],
+        'AZURE_OPENAI_DEPLOYMENT': current_app.config['AZURE_OPENAI_DEPLOYMENT']
+    }
+    return event_stream(stream_question_summary(content, config))
@@ -0,0 +1,125 @@
+import json
+import logging
+import os
+import random
+import time
+from config import Config
+from utils import http_client
+
+TERMINAL_STATUSES = {'completed', 'failed', 'expired', 'cancelled'}
+
+class BatchJobError(RuntimeError):
+    """Raised when a batch job ends without a usable output file"""
+
+def build_batch_line(custom_id, prompt, deployment, max_tokens, temperature):
+    """One chat completion request in the batch JSONL input format"""
+    return {
+        'custom_id': custom_id,
+        'method': 'POST',
+        'url': '/chat/completions',
+        'body': {
+            'model': deployment,
+            'messages': [{'role': 'user', 'content': prompt}],
+            'temperature': temperature,
+            'max_tokens': max_tokens
+        }
+    }
+
+class AzureBatchClient:
+    """
+    Minimal client for the Azure OpenAI files and batches endpoints. Set
+    AZURE_BATCH_ENDPOINT to point it at local_batch_server.py instead.
+    """
+    def __init__(self, config, base_url=None):
+        self.base_url = (base_url or Config.AZURE_BATCH_ENDPOINT or config['AZURE_OPENAI_ENDPOINT']).rstrip('/')
+        self.api_version = Config.AZURE_BATCH_API_VERSION or config['AZURE_OPENAI_VERSION']
+        self.headers = {'api-key': config['AZURE_OPENAI_KEY'] or ''}
+
+    def url(self, path):
+        return f"{self.base_url}/openai/{path}?api-version={self.api_version}"
+
+    def upload_file(self, path):
+        """Upload a JSONL input file and return its file id"""
+        with open(path, 'rb') as f:
+            content = f.read()
+        response = http_client.post(
+            self.url('files'),
+            headers=self.headers,
+            data={'purpose': 'batch'},
+            files={'file': (os.path.basename(path), content, 'application/jsonl')}
+        )
+        response.raise_for_status()
+        return response.json()['id']
+
+    def create_batch(self, input_file_id, completion_window='24h'):
+        response = http_client.post(
+            self.url('batches'),
+            headers=self.headers,
+            json={
+                'input_file_id': input_file_id,
+                'endpoint': '/chat/completions',
+                'completion_window': completion_window
+            }
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def get_batch(self, batch_id):
+        response = http_client.get(self.url(f"batches/{batch_id}"), headers=self.headers)
+        response.raise_for_status()
+        return response.json()
+
+    def download_file(self, file_id):
+        response = http_client.get(self.url(f"files/{file_id}/content"), headers=self.headers)
+        response.raise_for_status()
+        return response.text
+
+    def wait_for_batch(self, batch_id, poll_interval=None, max_interval=None, timeout=None):
+        """Poll a batch with jittered exponential backoff until it reaches a terminal status"""
+        interval = poll_interval or Config.AZURE_BATCH_POLL_INTERVAL
+        max_interval = max_interval or Config.AZURE_BATCH_MAX_POLL_INTERVAL
+        deadline = time.monotonic() + (timeout or Config.AZURE_BATCH_TIMEOUT)
+
+        while True:
+            batch = self.get_batch(batch_id)
+            status = batch.get('status')
+            counts = batch.get('request_counts') or {}
+            logging.info(
+                f"Batch {batch_id} is {status} "
+                f"({counts.get('completed', 0)}/{counts.get('total', '?')} requests done)"
+            )
+            if status in TERMINAL_STATUSES:
+                return batch
+            if time.monotonic() >= deadline:
+                raise BatchJobError(f"Timed out waiting for batch {batch_id} (last status {status})")
+
+            delay = interval * random.uniform(0.8, 1.2)
+            time.sleep(min(delay, max(0.0, deadline - time.monotonic())))
+            interval = min(max_interval, interval * 2)
+
+    def run(self, input_path):
+        """
+        Submit a JSONL input file, wait for it to finish and return
+        {custom_id: completion body} for every request that succeeded.
+        """
+        file_id = self.upload_file(input_path)
+        batch = self.create_batch(file_id)
+        logging.info(f"Submitted batch {batch['id']} from {input_path}")
+
+        batch = self.wait_for_batch(batch['id'])
+        if not batch.get('output_file_id'):
+            raise BatchJobError(f"Batch {batch['id']} ended {batch.get('status')} without output")
+        if batch.get('error_file_id'):
+            logging.warning(f"Batch {batch['id']} reported failed requests in file {batch['error_file_id']}")
+
+        results = {}
+        for line in self.download_file(batch['output_file_id']).splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            response = record.get('response') or {}
+            if response.get('status_code') == 200 and not record.get('error'):
+                results[record['custom_id']] = response.get('body')
+            else:
+                logging.warning(f"Batch request {record.get('custom_id')} failed: {record.get('error') or response}")
+        return results
@@ -1,7 +1,16 @@
 import requests
+import hashlib
+import json
 import logging
+import os
+import threading
 import openai
 from config import Config
+from utils import http_client
+from utils.hedging import run_hedged
+from utils.rate_limiter import token_limiter
+from utils.sqlite_cache import SQLiteCache
+from utils.token_counter import count_tokens
 
 # Configure OpenAI settings
 openai.api_type = "azure"
@@ -9,15 +18,85 @@ openai.api_base = Config.AZURE_OPENAI_ENDPOINT
 openai.api_version = Config.AZURE_OPENAI_VERSION
 openai.api_key = Config.AZURE_OPENAI_KEY
 
+# Completion budget requested for every generation call
+DEFAULT_MAX_TOKENS = 3900
+DEFAULT_TEMPERATURE = 0.7
+
+_cache_lock = threading.Lock()
+_llm_cache = None
+_llm_cache_pid = None
+
 def get_azure_credentials():
     return Config.AZURE_OPENAI_KEY
 
-def call_azure_api(prompt, deployment_id, config):
+def estimate_tokens(prompt, max_tokens=DEFAULT_MAX_TOKENS, prompt_tokens=None):
+    """Prompt plus completion size, reserved before each call"""
+    if prompt_tokens is None:
+        prompt_tokens = count_tokens(prompt)
+    return prompt_tokens + max_tokens
+
+def completion_timeout(max_tokens):
+    """(connect, read) timeout for a non-streamed completion of up to max_tokens"""
+    return (Config.HTTP_CONNECT_TIMEOUT, Config.AZURE_READ_TIMEOUT + max_tokens / Config.AZURE_MIN_TOKENS_PER_SECOND)
+
+def get_llm_cache():
+    """Return this process's on-disk completion cache, or None when caching is disabled"""
+    global _llm_cache, _llm_cache_pid
+    if not Config.LLM_CACHE_ENABLED:
+        return None
+    pid = os.getpid()
+    if _llm_cache is None or _llm_cache_pid != pid:
+        with _cache_lock:
+            if _llm_cache is None or _llm_cache_pid != pid:
+                _llm_cache = SQLiteCache(
+                    Config.LLM_CACHE_PATH,
+                    ttl=Config.LLM_CACHE_TTL,
+                    max_bytes=Config.LLM_CACHE_MAX_MB * 1024 * 1024,
+                    name='azure_openai'
+                )
+                _llm_cache_pid = pid
+    return _llm_cache
+
+def llm_cache_key(deployment_name, prompt, temperature, max_tokens):
+    """Content address of a completion request"""
+    return hashlib.sha256(json.dumps(
+        [deployment_name, prompt, temperature, max_tokens], ensure_ascii=False
+    ).encode('utf-8')).hexdigest()
+
+def call_azure_api(prompt, deployment_id, config, use_cache=True, cache_if=None,
+                   max_tokens=DEFAULT_MAX_TOKENS, temperature=DEFAULT_TEMPERATURE, rate_limiter=None,
+                   prompt_tokens=None, timeout=None):
+    """
+    Send a single-message chat completion to the configured deployment.
+    Identical requests are answered from the completion cache without
+    spending tokens; use_cache=False bypasses it. When cache_if is given,
+    a response is only cached if cache_if(response) is true. Tokens are
+    admitted against deployment_id's share of rate_limiter (the shared
+    token_limiter by default) and reconciled with the response's usage.
+    Pass prompt_tokens when the caller has already counted the prompt, and
+    timeout (see completion_timeout) for completions that may outrun
+    AZURE_READ_TIMEOUT. With LLM_HEDGE_ENABLED the call goes through
+    call_azure_api_hedged.
+    """
+    if Config.LLM_HEDGE_ENABLED:
+        return call_azure_api_hedged(
+            prompt, deployment_id, config, use_cache=use_cache, cache_if=cache_if, max_tokens=max_tokens,
+            temperature=temperature, rate_limiter=rate_limiter, prompt_tokens=prompt_tokens, timeout=timeout
+        )
+
     azure_openai_endpoint = config['AZURE_OPENAI_ENDPOINT']
     azure_openai_key = config['AZURE_OPENAI_KEY']
     deployment_name = config['AZURE_OPENAI_DEPLOYMENT']
     api_version = config['AZURE_OPENAI_VERSION']
 
+    cache = get_llm_cache() if use_cache else None
+    if cache:
+        key = llm_cache_key(deployment_name, prompt, temperature, max_tokens)
+        cached = cache.get(key)
+        if cached is not None:
+            logging.debug(f"Completion cache hit for {deployment_id}")
+            return json.loads(cached)
+
     headers = {
         "Content-Type": "application/json",
         "api-key": azure_openai_key,
@@ -27,22 +106,189 @@ def call_azure_api(prompt, deployment_id, config):
         "messages": [
             {"role": "user", "content": prompt}
         ],
-        "temperature": 0.7,
-        "max_tokens": 3900
+        "temperature": temperature,
+        "max_tokens": max_tokens
     }
 
     logging.debug(f"Sending payload to Azure API: {payload}")
 
     url = f"{azure_openai_endpoint}/openai/deployments/{deployment_name}/chat/completions?api-version={api_version}"
 
+    rate_limiter = rate_limiter or token_limiter
+    reservation = rate_limiter.acquire(deployment_id, estimate_tokens(prompt, max_tokens, prompt_tokens))
+
     try:
-        response = requests.post(url, headers=headers, json=payload, timeout=30)
+        response = http_client.post(url, headers=headers, json=payload, timeout=timeout)
         response.raise_for_status()
-        logging.debug(f"Azure API response: {response.json()}")
-        return response.json()
+        result = response.json()
+        logging.debug(f"Azure API response: {result}")
+        rate_limiter.reconcile(reservation, result.get('usage'))
     except requests.exceptions.RequestException as e:
         logging.error(f"Error calling Azure API: {str(e)}")
         if hasattr(e, 'response') and e.response is not None:
             logging.error(f"Response status code: {e.response.status_code}")
             logging.error(f"Response content: {e.response.text}")
         return None  # Return None instead of raising an exception
+
+    if cache and should_cache(result, cache_if):
+        cache.set(key, json.dumps(result).encode('utf-8'), {'deployment': deployment_name})
+    return result
+
+def should_cache(result, cache_if):
+    if not result or 'choices' not in result:
+        return False
+    if cache_if is None:
+        return True
+    try:
+        return bool(cache_if(result))
+    except Exception as e:
+        logging.debug(f"Not caching completion that failed validation: {str(e)}")
+        return False
+
+class CompletionStream:
+    """
+    Streamed (SSE) chat completion. Iterating yields content fragments as
+    they arrive; afterwards .content holds the full text and .response the
+    same dict shape call_azure_api returns. Cache hits yield the cached
+    content as a single fragment, and a finished stream is cached the
+    same way call_azure_api caches a response. Streamed responses carry
+    no usage block unless the service adds one, so the reservation is
+    otherwise reconciled with a local count of the prompt and output.
+    """
+    def __init__(self, prompt, deployment_id, config, use_cache=True, cache_if=None,
+                 max_tokens=DEFAULT_MAX_TOKENS, temperature=DEFAULT_TEMPERATURE, rate_limiter=None,
+                 prompt_tokens=None, timeout=None):
+        self.prompt = prompt
+        self.deployment_id = deployment_id
+        self.config = config
+        self.use_cache = use_cache
+        self.cache_if = cache_if
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.rate_limiter = rate_limiter or token_limiter
+        self.prompt_tokens = count_tokens(prompt) if prompt_tokens is None else prompt_tokens
+        self.timeout = timeout
+        self.usage = None
+        self.parts = []
+        self.finish_reason = None
+        self.response = None
+
+    @property
+    def content(self):
+        return ''.join(self.parts)
+
+    def __iter__(self):
+        deployment_name = self.config['AZURE_OPENAI_DEPLOYMENT']
+        cache = get_llm_cache() if self.use_cache else None
+        if cache:
+            key = llm_cache_key(deployment_name, self.prompt, self.temperature, self.max_tokens)
+            cached = cache.get(key)
+            if cached is not None:
+                logging.debug(f"Completion cache hit for {self.deployment_id}")
+                self.response = json.loads(cached)
+                content = self.response['choices'][0]['message']['content']
+                self.parts = [content]
+                yield content
+                return
+
+        url = (
+            f"{self.config['AZURE_OPENAI_ENDPOINT']}/openai/deployments/{deployment_name}"
+            f"/chat/completions?api-version={self.config['AZURE_OPENAI_VERSION']}"
+        )
+        payload = {
+            "messages": [
+                {"role": "user", "content": self.prompt}
+            ],
+            "temperature": self.temperature,
+            "max_tokens": self.max_tokens,
+            "stream": True
+        }
+
+        reservation = self.rate_limiter.acquire(self.deployment_id, self.prompt_tokens + self.max_tokens)
+
+        response = http_client.post(
+            url,
+            headers={"Content-Type": "application/json", "api-key": self.config['AZURE_OPENAI_KEY']},
+            json=payload,
+            stream=True,
+            timeout=self.timeout
+        )
+        try:
+            response.raise_for_status()
+            for raw_line in response.iter_lines():
+                line = raw_line.decode('utf-8')
+                if not line.startswith('data:'):
+                    continue
+                data = line[len('data:'):].strip()
+                if data == '[DONE]':
+                    break
+                chunk = json.loads(data)
+                if chunk.get('usage'):
+                    self.usage = chunk['usage']
+                for choice in chunk.get('choices') or []:
+                    if choice.get('finish_reason'):
+                        self.finish_reason = choice['finish_reason']
+                    delta = (choice.get('delta') or {}).get('content')
+                    if delta:
+                        self.parts.append(delta)
+                        yield delta
+        finally:
+            response.close()
+            if self.usage:
+                self.rate_limiter.reconcile(reservation, self.usage)
+            else:
+                self.rate_limiter.reconcile(reservation, tokens=self.prompt_tokens + count_tokens(self.content))
+
+        self.response = {
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': self.content},
+                'finish_reason': self.finish_reason
+            }]
+        }
+        if self.usage:
+            self.response['usage'] = self.usage
+        if cache and should_cache(self.response, self.cache_if):
+            cache.set(key, json.dumps(self.response).encode('utf-8'), {'deployment': deployment_name})
+
+def call_azure_api_stream(prompt, deployment_id, config, **kwargs):
+    """Streaming counterpart of call_azure_api; see CompletionStream"""
+    return CompletionStream(prompt, deployment_id, config, **kwargs)
+
+def stream_until_cancelled(prompt, deployment_id, config, cancelled, **kwargs):
+    """Consume a completion stream, closing it early once cancelled is set"""
+    stream = CompletionStream(prompt, deployment_id, config, **kwargs)
+    fragments = iter(stream)
+    try:
+        for _ in fragments:
+            if cancelled.is_set():
+                return None
+    finally:
+        # Closes the HTTP response, so an abandoned generation stops server-side
+        fragments.close()
+    return stream.response
+
+def call_azure_api_hedged(prompt, deployment_id, config, **kwargs):
+    """
+    call_azure_api with hedging against the latency tail. The completion is
+    streamed; if it has not finished by the adaptive p95 latency for this
+    kind of request, a duplicate is sent (to AZURE_OPENAI_HEDGE_DEPLOYMENT
+    when set) and whichever finishes first wins. The loser's stream is
+    closed. Duplicate tokens are capped by LLM_HEDGE_MAX_FRACTION.
+    """
+    hedge_config = config
+    if Config.AZURE_OPENAI_HEDGE_DEPLOYMENT:
+        hedge_config = dict(config, AZURE_OPENAI_DEPLOYMENT=Config.AZURE_OPENAI_HEDGE_DEPLOYMENT)
+    max_tokens = kwargs.get('max_tokens', DEFAULT_MAX_TOKENS)
+    tokens = estimate_tokens(prompt, max_tokens, kwargs.get('prompt_tokens'))
+
+    try:
+        return run_hedged(
+            lambda cancelled: stream_until_cancelled(prompt, deployment_id, config, cancelled, **kwargs),
+            lambda cancelled: stream_until_cancelled(prompt, deployment_id, hedge_config, cancelled, **kwargs),
+            (deployment_id, max_tokens),
+            tokens
+        )
+    except (requests.exceptions.RequestException, ValueError) as e:
+        logging.error(f"Error calling Azure API: {str(e)}")
+        return None  # Match call_azure_api, which returns None instead of raising
@@ -0,0 +1,133 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from config import Config
+
+_executor = None
+_lock = threading.Lock()
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=Config.LLM_MAX_WORKERS * 2, thread_name_prefix='hedge')
+    return _executor
+
+class LatencyTracker:
+    """Recent completion latencies for one kind of request, and their hedging threshold"""
+    def __init__(self, size=200, percentile=None, min_samples=None, initial_delay=None):
+        self.samples = deque(maxlen=size)
+        self.percentile = percentile or Config.LLM_HEDGE_PERCENTILE
+        self.min_samples = min_samples or Config.LLM_HEDGE_MIN_SAMPLES
+        self.initial_delay = initial_delay or Config.LLM_HEDGE_INITIAL_DELAY
+        self.lock = threading.Lock()
+
+    def record(self, latency):
+        with self.lock:
+            self.samples.append(latency)
+
+    def threshold(self):
+        """Seconds to wait before hedging: the tracked percentile, or initial_delay until there are enough samples"""
+        with self.lock:
+            if len(self.samples) < self.min_samples:
+                return self.initial_delay
+            ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))]
+
+class HedgeBudget:
+    """Caps duplicate tokens at a fixed fraction of the tokens sent by primary requests"""
+    def __init__(self, max_fraction=None):
+        self.max_fraction = Config.LLM_HEDGE_MAX_FRACTION if max_fraction is None else max_fraction
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'primary_tokens': 0, 'hedges': 0, 'hedge_tokens': 0, 'hedge_wins': 0, 'denied': 0}
+
+    def record_request(self, tokens):
+        with self.lock:
+            self.stats['requests'] += 1
+            self.stats['primary_tokens'] += tokens
+
+    def try_hedge(self, tokens):
+        with self.lock:
+            if self.stats['hedge_tokens'] + tokens > self.max_fraction * self.stats['primary_tokens']:
+                self.stats['denied'] += 1
+                return False
+            self.stats['hedges'] += 1
+            self.stats['hedge_tokens'] += tokens
+            return True
+
+    def record_win(self):
+        with self.lock:
+            self.stats['hedge_wins'] += 1
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats)
+
+hedge_budget = HedgeBudget()
+_trackers = {}
+
+def get_tracker(key):
+    tracker = _trackers.get(key)
+    if tracker is None:
+        with _lock:
+            tracker = _trackers.setdefault(key, LatencyTracker())
+    return tracker
+
+def run_hedged(attempt, hedge_attempt, key, tokens, budget=None):
+    """
+    Run attempt(cancelled) and, if it is still running after the key's
+    latency threshold and the budget allows, hedge_attempt(cancelled)
+    alongside it. Returns the first non-None result and sets the other
+    attempt's cancelled event so it can abandon its request. Raises the
+    last error if no attempt succeeds.
+    """
+    budget = budget or hedge_budget
+    tracker = get_tracker(key)
+    executor = get_executor()
+
+    # Latency is measured from the primary's start whichever attempt wins,
+    # so a winning hedge records what the caller actually waited
+    start = time.monotonic()
+
+    def timed(func, cancelled):
+        result = func(cancelled)
+        if result is not None and not cancelled.is_set():
+            tracker.record(time.monotonic() - start)
+        return result
+
+    budget.record_request(tokens)
+    cancel_events = {}
+    primary_cancelled = threading.Event()
+    primary = executor.submit(timed, attempt, primary_cancelled)
+    cancel_events[primary] = primary_cancelled
+
+    delay = tracker.threshold()
+    done, _ = wait([primary], timeout=delay)
+    if not done and budget.try_hedge(tokens):
+        logging.info(f"Hedging {key} request still running after {delay:.1f}s")
+        hedge_cancelled = threading.Event()
+        cancel_events[executor.submit(timed, hedge_attempt, hedge_cancelled)] = hedge_cancelled
+
+    pending = set(cancel_events)
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                result = future.result()
+            except Exception as e:
+                error = e
+                continue
+            if result is None:
+                continue
+            for other in pending:
+                cancel_events[other].set()
+            if future is not primary:
+                budget.record_win()
+            return result
+    if error:
+        raise error
+    return None
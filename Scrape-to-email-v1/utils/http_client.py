@@ -0,0 +1,121 @@
+import logging
+import os
+import threading
+from urllib.parse import urlparse
+import httpx
+import openai
+import requests
+from requests.adapters import HTTPAdapter
+from config import Config
+from utils.retry import RETRY_STATUSES, call_with_retry, classify_post_response, classify_response, parse_retry_after
+
+CTGOV_PREFIX = "https://clinicaltrials.gov/"
+
+_lock = threading.Lock()
+_session = None
+_session_pid = None
+_azure_clients = {}
+
+def _build_session():
+    session = requests.Session()
+    session.headers.update({
+        'Accept-Encoding': 'gzip, deflate',
+        'Connection': 'keep-alive'
+    })
+
+    # Size each host's keep-alive pool to the concurrency we run against it
+    session.mount(CTGOV_PREFIX, HTTPAdapter(
+        pool_connections=1, pool_maxsize=Config.CTGOV_POOL_SIZE
+    ))
+    if Config.AZURE_OPENAI_ENDPOINT:
+        session.mount(Config.AZURE_OPENAI_ENDPOINT.rstrip('/') + '/', HTTPAdapter(
+            pool_connections=1, pool_maxsize=Config.AZURE_POOL_SIZE
+        ))
+    session.mount('https://', HTTPAdapter(pool_maxsize=Config.HTTP_POOL_SIZE))
+    session.mount('http://', HTTPAdapter(pool_maxsize=Config.HTTP_POOL_SIZE))
+    return session
+
+def get_session():
+    """Return the process-wide pooled session, rebuilding it after a fork"""
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _lock:
+            if _session is None or _session_pid != pid:
+                logging.debug(f"Creating pooled HTTP session for process {pid}")
+                _session = _build_session()
+                _session_pid = pid
+    return _session
+
+def default_timeout(url):
+    """Return the (connect, read) timeout for a URL's host"""
+    if url.startswith(CTGOV_PREFIX):
+        return (Config.HTTP_CONNECT_TIMEOUT, Config.CTGOV_READ_TIMEOUT)
+    if 'openai.azure.com' in urlparse(url).netloc or (
+        Config.AZURE_OPENAI_ENDPOINT and url.startswith(Config.AZURE_OPENAI_ENDPOINT)
+    ):
+        return (Config.HTTP_CONNECT_TIMEOUT, Config.AZURE_READ_TIMEOUT)
+    return (Config.HTTP_CONNECT_TIMEOUT, Config.HTTP_READ_TIMEOUT)
+
+def request(method, url, timeout=None, **kwargs):
+    """
+    Send a request through the pooled session with the host's default
+    timeout, retrying throttling, server errors and connection failures.
+    POSTs are not retried after a read timeout.
+    """
+    if timeout is None:
+        timeout = default_timeout(url)
+    return call_with_retry(
+        lambda: get_session().request(method, url, timeout=timeout, **kwargs),
+        urlparse(url).netloc,
+        classify_post_response if method.upper() == 'POST' else classify_response
+    )
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+def post(url, **kwargs):
+    return request('POST', url, **kwargs)
+
+def get_azure_openai_client(config):
+    """Return a cached AzureOpenAI client that reuses one keep-alive pool per endpoint"""
+    key = (
+        os.getpid(),
+        config['AZURE_OPENAI_ENDPOINT'],
+        config['AZURE_OPENAI_KEY'],
+        config['AZURE_OPENAI_VERSION']
+    )
+    client = _azure_clients.get(key)
+    if client is None:
+        with _lock:
+            client = _azure_clients.get(key)
+            if client is None:
+                http_client = httpx.Client(
+                    limits=httpx.Limits(
+                        max_connections=Config.AZURE_POOL_SIZE,
+                        max_keepalive_connections=Config.AZURE_POOL_SIZE
+                    ),
+                    timeout=httpx.Timeout(Config.AZURE_READ_TIMEOUT, connect=Config.HTTP_CONNECT_TIMEOUT)
+                )
+                # Retries are handled by call_openai_with_retry, not the SDK
+                client = openai.AzureOpenAI(
+                    api_key=config['AZURE_OPENAI_KEY'],
+                    api_version=config['AZURE_OPENAI_VERSION'],
+                    azure_endpoint=config['AZURE_OPENAI_ENDPOINT'],
+                    http_client=http_client,
+                    max_retries=0
+                )
+                _azure_clients[key] = client
+    return client
+
+def classify_openai_error(result, error):
+    if error is None:
+        return False, None
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRY_STATUSES, parse_retry_after(error.response.headers)
+    # A timed-out completion may still be generated and billed; don't send it again
+    return isinstance(error, openai.APIConnectionError) and not isinstance(error, openai.APITimeoutError), None
+
+def call_openai_with_retry(config, func):
+    """Run an Azure OpenAI SDK call under the shared retry and circuit-breaker policy"""
+    return call_with_retry(func, urlparse(config['AZURE_OPENAI_ENDPOINT']).netloc, classify_openai_error)
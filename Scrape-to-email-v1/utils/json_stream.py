@@ -0,0 +1,97 @@
+import json
+
+CLOSERS = {'{': '}', '[': ']'}
+
+class IncrementalJSONAssembler:
+    """
+    Assemble a JSON document from streamed text fragments. The bracket and
+    string state is tracked as each fragment arrives, so snapshot() can
+    close whatever is still open and parse a best-effort partial value
+    without rescanning the text. Any leading ```json fence or prose before
+    the first { or [ is skipped.
+    """
+    def __init__(self):
+        self.parts = []
+        self.started = False
+        self.complete = False
+        self.stack = []
+        self.in_string = False
+        self.escape = False
+        self.string_start = 0
+        self.length = 0
+        self.last_snapshot = None
+
+    def feed(self, text):
+        if self.complete:
+            return
+        if not self.started:
+            starts = [i for i in (text.find('{'), text.find('[')) if i >= 0]
+            if not starts:
+                return
+            text = text[min(starts):]
+            self.started = True
+
+        for i, char in enumerate(text):
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == '\\':
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+                self.string_start = self.length + i
+            elif char in CLOSERS:
+                self.stack.append(char)
+            elif char in '}]' and self.stack:
+                self.stack.pop()
+                if not self.stack:
+                    # Root value closed; ignore any trailing fence or prose
+                    text = text[:i + 1]
+                    self.complete = True
+                    break
+        self.parts.append(text)
+        self.length += len(text)
+
+    @property
+    def text(self):
+        return ''.join(self.parts)
+
+    def snapshot(self):
+        """Best-effort parse of the text so far, or the last good snapshot"""
+        if not self.started:
+            return None
+        if self.complete:
+            self.last_snapshot = self.result()
+            return self.last_snapshot
+
+        text = self.text
+        closing = ''.join(CLOSERS[char] for char in reversed(self.stack))
+        if self.in_string:
+            # Close an open string value, or drop it if it is an unfinished key
+            candidates = [
+                text[:-1] + '"' if self.escape else text + '"',
+                text[:self.string_start].rstrip().rstrip(',')
+            ]
+        else:
+            stripped = text.rstrip().rstrip(',')
+            candidates = [stripped, stripped + 'null']
+            # Drop a partially streamed literal or number after the last separator
+            cut = max(stripped.rfind(char) for char in ',:[{')
+            if cut >= 0:
+                candidates.append(stripped[:cut + 1].rstrip(',') + ('null' if stripped[cut] == ':' else ''))
+
+        for candidate in candidates:
+            try:
+                self.last_snapshot = json.loads(candidate + closing)
+                return self.last_snapshot
+            except ValueError:
+                continue
+        return self.last_snapshot
+
+    def result(self):
+        """Parse the complete document, raising ValueError if it is not valid JSON"""
+        if not self.complete:
+            raise ValueError("Streamed JSON is incomplete")
+        return json.loads(self.text)
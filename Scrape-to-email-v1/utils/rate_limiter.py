@@ -1,77 +1,172 @@
-import tiktoken
+import asyncio
+import logging
+import threading
 import time
 from collections import deque
-from flask import current_app
-import logging
+from config import Config
+from utils.token_counter import count_tokens
+
+# Share of the total tokens-per-minute budget each caller may use
+DEFAULT_ENDPOINT_SHARES = {
+    'email_generation': 0.6,
+    'outreach_email': 0.4,
+    'summary': 0.2,
+    'default': 0.2
+}
+
+def usage_tokens(usage):
+    """Total tokens from a usage block, as a REST dict or an SDK object"""
+    if usage is None:
+        return None
+    if isinstance(usage, dict):
+        prompt, completion = usage.get('prompt_tokens'), usage.get('completion_tokens')
+    else:
+        prompt, completion = getattr(usage, 'prompt_tokens', None), getattr(usage, 'completion_tokens', None)
+    if prompt is None and completion is None:
+        return None
+    return (prompt or 0) + (completion or 0)
+
+class Reservation:
+    """Tokens admitted for one request; reconcile() with the real usage afterwards"""
+    __slots__ = ('timestamp', 'endpoint', 'tokens', 'expired')
+
+    def __init__(self, timestamp, endpoint, tokens):
+        self.timestamp = timestamp
+        self.endpoint = endpoint
+        self.tokens = tokens
+        self.expired = False
+
 class AdaptiveRateLimiter:
-    def __init__(self, total_tokens_per_minute):
+    """
+    Sliding-window tokens-per-minute limiter with a total budget and a
+    per-endpoint share of it. Running sums are kept per endpoint and in
+    total, so admitting or expiring a request is O(1). acquire() and
+    acquire_async() wait for capacity instead of raising; reconcile()
+    corrects a reservation once the response reports its actual prompt
+    and completion tokens.
+    """
+    def __init__(self, total_tokens_per_minute, endpoint_shares=None, window=60.0):
         self.total_tokens_per_minute = total_tokens_per_minute
+        self.window = window
+        shares = endpoint_shares or DEFAULT_ENDPOINT_SHARES
         self.endpoint_limits = {
-            'qa_generation': 400000,
-            'mcq_generation': 400000,
-            'default': 200000
+            endpoint: int(total_tokens_per_minute * share) for endpoint, share in shares.items()
         }
-        self.endpoint_queues = {endpoint: deque() for endpoint in self.endpoint_limits}
-        self.last_reset = time.time()
-        self.usage_history = deque(maxlen=60)  # Store last 60 seconds of usage
-        self.encoder = None
-
-    def get_encoder(self):
-        if self.encoder is None:
-            try:
-                from flask import current_app
-                encoding_name = current_app.config['TOKEN_ENCODING']
-                logging.info(f"Initializing encoder with encoding: {encoding_name}")
-                self.encoder = tiktoken.get_encoding(encoding_name)
-            except Exception as e:
-                logging.error(f"Error initializing encoder: {str(e)}")
-                raise
-        return self.encoder
-
-    def count_tokens(self, text):
-        try:
-            encoder = self.get_encoder()
-            return len(encoder.encode(text))
-        except Exception as e:
-            logging.error(f"Error in count_tokens: {str(e)}")
-            raise
-    def add_request(self, endpoint, text):
-        tokens = self.count_tokens(text)
-        current_time = time.time()
-        self._reset_if_necessary(current_time)
+        self.lock = threading.Lock()
+        self.reservations = deque()
+        self.endpoint_totals = {endpoint: 0 for endpoint in self.endpoint_limits}
+        self.total = 0
+        self.stats = {
+            'calls': 0,
+            'waited_calls': 0,
+            'total_wait': 0.0,
+            'max_wait': 0.0,
+            'reconciled_tokens': 0
+        }
+
+    def resolve_endpoint(self, endpoint):
+        return endpoint if endpoint in self.endpoint_limits else 'default'
 
-        limit = self.endpoint_limits.get(endpoint, self.endpoint_limits['default'])
-        queue = self.endpoint_queues[endpoint if endpoint in self.endpoint_limits else 'default']
+    def _expire(self, now):
+        while self.reservations and now - self.reservations[0].timestamp >= self.window:
+            reservation = self.reservations.popleft()
+            reservation.expired = True
+            self.endpoint_totals[reservation.endpoint] -= reservation.tokens
+            self.total -= reservation.tokens
 
-        queue.append((current_time, tokens))
+    def _record(self, endpoint, tokens, now):
+        reservation = Reservation(now, endpoint, tokens)
+        self.reservations.append(reservation)
+        self.endpoint_totals[endpoint] += tokens
+        self.total += tokens
+        return reservation
 
-        while queue and current_time - queue[0][0] >= 60:
-            queue.popleft()
+    def _try_reserve(self, endpoint, tokens):
+        """Reserve tokens if they fit; otherwise return the seconds until capacity may free up"""
+        now = time.monotonic()
+        with self.lock:
+            self._expire(now)
+            fits = (
+                self.endpoint_totals[endpoint] + tokens <= self.endpoint_limits[endpoint]
+                and self.total + tokens <= self.total_tokens_per_minute
+            )
+            # A request larger than the whole budget is admitted once the window is empty
+            if fits or not self.reservations:
+                return self._record(endpoint, tokens, now), 0.0
+            return None, max(0.01, self.reservations[0].timestamp + self.window - now)
 
-        if sum(tokens for _, tokens in queue) + tokens > limit:
-            raise Exception(f"Rate limit exceeded for endpoint {endpoint}")
+    def _record_wait(self, waited):
+        with self.lock:
+            self.stats['calls'] += 1
+            if waited > 0:
+                self.stats['waited_calls'] += 1
+                self.stats['total_wait'] += waited
+                self.stats['max_wait'] = max(self.stats['max_wait'], waited)
 
-        total_tokens = sum(sum(tokens for _, tokens in q) for q in self.endpoint_queues.values())
-        if total_tokens + tokens > self.total_tokens_per_minute:
-            raise Exception("Total rate limit exceeded across all endpoints")
+    def acquire(self, endpoint, tokens):
+        """Block until tokens fit in endpoint's share and the total budget"""
+        endpoint = self.resolve_endpoint(endpoint)
+        waited = 0.0
+        while True:
+            reservation, delay = self._try_reserve(endpoint, tokens)
+            if reservation:
+                self._record_wait(waited)
+                return reservation
+            logging.debug(f"Token limiter waiting {delay:.2f}s for {tokens} {endpoint} tokens")
+            time.sleep(delay)
+            waited += delay
 
-        self.usage_history.append(total_tokens)
-        self._adjust_limits()
+    async def acquire_async(self, endpoint, tokens):
+        """Await until tokens fit in endpoint's share and the total budget"""
+        endpoint = self.resolve_endpoint(endpoint)
+        waited = 0.0
+        while True:
+            reservation, delay = self._try_reserve(endpoint, tokens)
+            if reservation:
+                self._record_wait(waited)
+                return reservation
+            await asyncio.sleep(delay)
+            waited += delay
+
+    def reconcile(self, reservation, usage=None, tokens=None):
+        """
+        Replace a reservation's estimate with the tokens actually used,
+        taken from a response's usage block or given directly.
+        """
+        actual = usage_tokens(usage) if tokens is None else tokens
+        if reservation is None or actual is None:
+            return
+        with self.lock:
+            delta = actual - reservation.tokens
+            self.stats['reconciled_tokens'] += delta
+            if not reservation.expired:
+                self.endpoint_totals[reservation.endpoint] += delta
+                self.total += delta
+            reservation.tokens = actual
 
+    def add_request(self, endpoint, text):
+        """Record a request's prompt tokens without waiting; returns the token count"""
+        tokens = count_tokens(text)
+        endpoint = self.resolve_endpoint(endpoint)
+        now = time.monotonic()
+        with self.lock:
+            self._expire(now)
+            self._record(endpoint, tokens, now)
+            if self.total > self.total_tokens_per_minute:
+                logging.warning(f"Token usage {self.total} is over the {self.total_tokens_per_minute} per-minute budget")
         return tokens
 
-    def _reset_if_necessary(self, current_time):
-        if current_time - self.last_reset >= 60:
-            for queue in self.endpoint_queues.values():
-                queue.clear()
-            self.last_reset = current_time
+    def get_usage(self):
+        """Tokens used in the current window, in total and per endpoint"""
+        with self.lock:
+            self._expire(time.monotonic())
+            return {'total': self.total, 'endpoints': dict(self.endpoint_totals)}
 
-    def _adjust_limits(self):
-        if not self.usage_history:
-            return
-        
-        avg_usage = sum(self.usage_history) / len(self.usage_history)
-        if avg_usage > 0.9 * self.total_tokens_per_minute:
-            self.endpoint_limits = {k: int(v * 0.9) for k, v in self.endpoint_limits.items()}
-        elif avg_usage < 0.5 * self.total_tokens_per_minute:
-            self.endpoint_limits = {k: min(int(v * 1.1), self.total_tokens_per_minute) for k, v in self.endpoint_limits.items()}
\ No newline at end of file
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+        stats['average_wait'] = stats['total_wait'] / stats['calls'] if stats['calls'] else 0.0
+        return stats
+
+# Shared by every Azure OpenAI caller in this process
+token_limiter = AdaptiveRateLimiter(Config.TOTAL_TOKENS_PER_MINUTE)
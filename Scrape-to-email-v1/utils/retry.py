@@ -0,0 +1,185 @@
+import logging
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+import requests
+from config import Config
+
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Raised instead of calling a host whose circuit breaker is open"""
+
+class CircuitBreaker:
+    """
+    Per-host circuit breaker. Opens after failure_threshold consecutive
+    server errors, timeouts or connection failures, rejects calls for
+    reset_timeout seconds, then lets a single trial call through
+    (half-open) before closing again. Throttling (429) is not a failure:
+    the host is up and says when to come back.
+    """
+    def __init__(self, host, failure_threshold, reset_timeout):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def before_call(self):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at < self.reset_timeout or self.trial_in_flight:
+                raise CircuitOpenError(f"Circuit open for {self.host}")
+            self.trial_in_flight = True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_throttled(self):
+        with self.lock:
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logging.warning(f"Opening circuit for {self.host} after {self.failures} failures")
+                self.opened_at = time.monotonic()
+
+class RetryBudget:
+    """Caps the number of retries a single run may spend across all hosts"""
+    def __init__(self, max_retries):
+        self.max_retries = max_retries
+        self.lock = threading.Lock()
+        self.spent = 0
+
+    def try_spend(self):
+        with self.lock:
+            if self.spent >= self.max_retries:
+                return False
+            self.spent += 1
+            return True
+
+    def reset(self):
+        with self.lock:
+            self.spent = 0
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+retry_budget = RetryBudget(Config.RETRY_BUDGET)
+
+def get_breaker(host):
+    with _breakers_lock:
+        if host not in _breakers:
+            _breakers[host] = CircuitBreaker(host, Config.CIRCUIT_FAILURE_THRESHOLD, Config.CIRCUIT_RESET_TIMEOUT)
+        return _breakers[host]
+
+def reset_retry_budget():
+    """Start a new run with a full retry budget"""
+    retry_budget.reset()
+
+def parse_retry_after(headers):
+    """Return the server's requested delay in seconds from retry-after-ms or Retry-After"""
+    if not headers:
+        return None
+    retry_after_ms = headers.get('retry-after-ms')
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000.0
+        except ValueError:
+            pass
+    retry_after = headers.get('Retry-After')
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    return None
+
+def backoff_delay(attempt):
+    """Full-jitter exponential backoff"""
+    return random.uniform(0, min(Config.RETRY_MAX_DELAY, Config.RETRY_BASE_DELAY * (2 ** attempt)))
+
+def classify_response(response, error):
+    """Decide whether a requests call should be retried, and after how long"""
+    if error is not None:
+        return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)), None
+    if response.status_code in RETRY_STATUSES:
+        return True, parse_retry_after(response.headers)
+    return False, None
+
+def classify_post_response(response, error):
+    """
+    classify_response for POSTs. A read timeout may come after the server
+    took the request (Azure keeps generating, and bills, the completion),
+    so only failures to connect are retried.
+    """
+    if isinstance(error, requests.exceptions.Timeout) and not isinstance(error, requests.exceptions.ConnectTimeout):
+        return False, None
+    return classify_response(response, error)
+
+def is_throttled(result, error):
+    """True for a 429 response or SDK error"""
+    return getattr(result, 'status_code', None) == 429 or getattr(error, 'status_code', None) == 429
+
+def call_with_retry(func, host, classify=classify_response, max_attempts=None):
+    """
+    Call func with jittered exponential backoff, honoring Retry-After,
+    behind host's circuit breaker and the run's retry budget. classify
+    maps (result, error) to (retryable, retry_after). When retries run out
+    the last error is raised, or the last result returned for the caller
+    to handle.
+    """
+    max_attempts = max_attempts or Config.RETRY_MAX_ATTEMPTS
+    breaker = get_breaker(host)
+    attempt = 0
+
+    while True:
+        breaker.before_call()
+        try:
+            result, error = func(), None
+        except Exception as e:
+            result, error = None, e
+
+        retryable, retry_after = classify(result, error)
+        if not retryable:
+            breaker.record_success()
+            if error is not None:
+                raise error
+            return result
+
+        if is_throttled(result, error):
+            breaker.record_throttled()
+        else:
+            breaker.record_failure()
+        attempt += 1
+        if attempt >= max_attempts:
+            logging.error(f"Giving up on {host} after {attempt} attempts")
+        elif not retry_budget.try_spend():
+            logging.error(f"Retry budget of {retry_budget.max_retries} exhausted; not retrying {host}")
+        else:
+            delay = max(retry_after or 0.0, backoff_delay(attempt))
+            delay = min(delay, Config.RETRY_MAX_RETRY_AFTER)
+            reason = str(error) if error is not None else f"status {getattr(result, 'status_code', '?')}"
+            logging.warning(f"Retrying {host} in {delay:.2f}s (attempt {attempt + 1}/{max_attempts}): {reason}")
+            # Release the discarded response's pooled connection (matters for stream=True)
+            if result is not None and hasattr(result, 'close'):
+                result.close()
+            time.sleep(delay)
+            continue
+
+        if error is not None:
+            raise error
+        return result
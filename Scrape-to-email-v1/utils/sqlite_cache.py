@@ -0,0 +1,144 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+class SQLiteCache:
+    """
+    Persistent key/value cache stored in a SQLite file, with a TTL,
+    least-recently-used eviction once max_bytes is exceeded, and hit/miss
+    counters. Entries past their TTL are kept until evicted so callers
+    can revalidate them instead of refetching.
+    """
+    def __init__(self, path, ttl=None, max_bytes=None, name='cache'):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.name = name
+        self.lock = threading.Lock()
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'stale': 0,
+            'revalidated': 0,
+            'writes': 0,
+            'evictions': 0
+        }
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            # WAL keeps the file consistent without an fsync on every commit
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, value BLOB, meta TEXT, "
+                "stored_at REAL, accessed_at REAL, size INTEGER)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at)")
+
+    def _is_fresh(self, stored_at):
+        return self.ttl is None or time.time() - stored_at < self.ttl
+
+    def get_entry(self, key):
+        """
+        Return {'value', 'meta', 'stored_at', 'fresh'} for a key, including
+        stale entries, or None if the key is not cached.
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT value, meta, stored_at FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.stats['misses'] += 1
+                return None
+
+            with self.conn:
+                self.conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (time.time(), key))
+
+            value, meta, stored_at = row
+            fresh = self._is_fresh(stored_at)
+            if fresh:
+                self.stats['hits'] += 1
+            else:
+                self.stats['stale'] += 1
+
+        return {
+            'value': value,
+            'meta': json.loads(meta) if meta else {},
+            'stored_at': stored_at,
+            'fresh': fresh
+        }
+
+    def get(self, key):
+        """Return the cached value if it is still fresh, otherwise None"""
+        entry = self.get_entry(key)
+        if entry and entry['fresh']:
+            return entry['value']
+        return None
+
+    def set(self, key, value, meta=None):
+        """Store a value, evicting least recently used entries if over max_bytes"""
+        now = time.time()
+        size = len(value) if value is not None else 0
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, meta, stored_at, accessed_at, size) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, value, json.dumps(meta or {}), now, now, size)
+            )
+            self.stats['writes'] += 1
+            self._evict()
+
+    def touch(self, key):
+        """Mark a stale entry as fresh again, e.g. after a 304 revalidation"""
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE entries SET stored_at = ?, accessed_at = ? WHERE key = ?", (now, now, key)
+            )
+            self.stats['revalidated'] += 1
+
+    def delete(self, key):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def clear(self):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM entries")
+
+    def _evict(self):
+        if not self.max_bytes:
+            return
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        evicted = 0
+        for key, size in self.conn.execute(
+            "SELECT key, size FROM entries ORDER BY accessed_at ASC"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            self.conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+            evicted += 1
+
+        self.stats['evictions'] += evicted
+        logging.debug(f"Evicted {evicted} entries from {self.name} cache")
+
+    def get_stats(self):
+        """Return hit/miss counters and current size"""
+        with self.lock:
+            stats = dict(self.stats)
+            stats['entries'], stats['bytes'] = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+        lookups = stats['hits'] + stats['misses'] + stats['stale']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,19 @@
+import json
+from flask import Response, stream_with_context
+
+def format_event(event, data):
+    """One server-sent event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def event_stream(events):
+    """
+    Flask response streaming (event, data) pairs as server-sent events.
+    Buffering is disabled so each event reaches the caller as it is sent.
+    """
+    response = Response(
+        stream_with_context(format_event(event, data) for event, data in events),
+        mimetype='text/event-stream'
+    )
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,120 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+
+class MemoryBucketState:
+    """Bucket state held in this process only"""
+    def __init__(self, capacity):
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def reserve(self, tokens, rate, capacity):
+        now = time.monotonic()
+        self.tokens = min(capacity, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        self.tokens -= tokens
+        return max(0.0, -self.tokens / rate)
+
+class SQLiteBucketState:
+    """Bucket state stored in a SQLite file so every process on the host shares one budget"""
+    def __init__(self, path, name, capacity):
+        self.path = path
+        self.name = name
+        conn = self._connect()
+        try:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tokens REAL, updated REAL)"
+            )
+            conn.execute(
+                "INSERT OR IGNORE INTO buckets (name, tokens, updated) VALUES (?, ?, ?)",
+                (name, capacity, time.time())
+            )
+        finally:
+            conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def reserve(self, tokens, rate, capacity):
+        conn = self._connect()
+        try:
+            # BEGIN IMMEDIATE takes the write lock, so the read-modify-write is atomic across processes
+            conn.execute("BEGIN IMMEDIATE")
+            current, updated = conn.execute(
+                "SELECT tokens, updated FROM buckets WHERE name = ?", (self.name,)
+            ).fetchone()
+            now = time.time()
+            current = min(capacity, current + max(0.0, now - updated) * rate) - tokens
+            conn.execute(
+                "UPDATE buckets SET tokens = ?, updated = ? WHERE name = ?",
+                (current, now, self.name)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return max(0.0, -current / rate)
+
+class TokenBucket:
+    """
+    Token-bucket rate limiter. Refills at rate tokens per second up to
+    capacity, so short bursts run without waiting. Callers reserve their
+    tokens up front and then sleep off any deficit, which keeps the bucket
+    fair under threads, asyncio tasks and, with state_path, across processes.
+    """
+    def __init__(self, rate, capacity=None, state_path=None, name='default'):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.name = name
+        self.lock = threading.Lock()
+        if state_path:
+            self.state = SQLiteBucketState(state_path, name, self.capacity)
+        else:
+            self.state = MemoryBucketState(self.capacity)
+        self.stats = {
+            'calls': 0,
+            'waited_calls': 0,
+            'total_wait': 0.0,
+            'max_wait': 0.0
+        }
+
+    def _reserve(self, tokens):
+        with self.lock:
+            delay = self.state.reserve(tokens, self.rate, self.capacity)
+            self.stats['calls'] += 1
+            if delay > 0:
+                self.stats['waited_calls'] += 1
+                self.stats['total_wait'] += delay
+                self.stats['max_wait'] = max(self.stats['max_wait'], delay)
+        if delay > 0:
+            logging.debug(f"Rate limiter {self.name} waiting {delay:.3f}s")
+        return delay
+
+    def acquire(self, tokens=1):
+        """Block until tokens are available and return the seconds waited"""
+        delay = self._reserve(tokens)
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    async def acquire_async(self, tokens=1):
+        """Await until tokens are available and return the seconds waited"""
+        delay = self._reserve(tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return delay
+
+    def wait(self):
+        return self.acquire()
+
+    def get_stats(self):
+        """Return call and wait statistics for this limiter"""
+        with self.lock:
+            stats = dict(self.stats)
+        stats['average_wait'] = stats['total_wait'] / stats['calls'] if stats['calls'] else 0.0
+        return stats
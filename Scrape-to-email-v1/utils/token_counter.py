@@ -0,0 +1,99 @@
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from string import Formatter
+import tiktoken
+from config import Config
+from models import db_manager, get_prompt
+
+# Distinct texts whose token counts are remembered
+MEMO_SIZE = 4096
+
+_encoder = None
+_encoder_lock = threading.Lock()
+_memo = OrderedDict()
+_memo_lock = threading.Lock()
+_templates = {}
+
+def get_encoder():
+    """
+    Load the configured tiktoken encoding once per process. Returns None
+    if it cannot be loaded, and the failure is not retried.
+    """
+    global _encoder
+    if _encoder is None:
+        with _encoder_lock:
+            if _encoder is None:
+                logging.info(f"Initializing encoder with encoding: {Config.TOKEN_ENCODING}")
+                try:
+                    _encoder = tiktoken.get_encoding(Config.TOKEN_ENCODING)
+                except Exception as e:
+                    logging.warning(f"Falling back to a character estimate for token counts: {str(e)}")
+                    _encoder = False
+    return _encoder or None
+
+def encode_count(text):
+    encoder = get_encoder()
+    if encoder is None:
+        return len(text) // 4
+    return len(encoder.encode(text, disallowed_special=()))
+
+def count_tokens(text):
+    """Token count of text, memoized by content hash"""
+    if not text:
+        return 0
+    key = hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+    with _memo_lock:
+        count = _memo.get(key)
+        if count is not None:
+            _memo.move_to_end(key)
+            return count
+    count = encode_count(text)
+    with _memo_lock:
+        _memo[key] = count
+        if len(_memo) > MEMO_SIZE:
+            _memo.popitem(last=False)
+    return count
+
+class TemplateCounter:
+    """
+    Token counter for a str.format template. The static segments are
+    counted once up front, so counting a filled-in prompt only encodes the
+    interpolated values. Tokens can merge across a segment boundary, so
+    the result may differ from counting the whole prompt by a token or
+    two per placeholder; close enough for rate limiting.
+    """
+    def __init__(self, template):
+        self.fields = []
+        literals = []
+        for literal, field_name, _, _ in Formatter().parse(template):
+            literals.append(literal)
+            if field_name is not None:
+                self.fields.append(field_name)
+        self.static_tokens = sum(encode_count(literal) for literal in literals if literal)
+
+    def count(self, **values):
+        return self.static_tokens + sum(count_tokens(str(values[field])) for field in self.fields)
+
+def template_counter(name):
+    """Counter for a prompt from models.DatabaseManager.prompts, built on first use"""
+    counter = _templates.get(name)
+    if counter is None:
+        prompt_data = get_prompt(name)
+        if not prompt_data:
+            raise ValueError(f"Prompt {name} not found")
+        counter = TemplateCounter(prompt_data.get('prompt_text') or prompt_data['regular_prompt'])
+        _templates[name] = counter
+    return counter
+
+def count_prompt(name, **values):
+    """Tokens in prompt name once formatted with values"""
+    return template_counter(name).count(**values)
+
+def warm_up():
+    """Load the encoder and precount every prompt template, e.g. at app startup"""
+    get_encoder()
+    for name in db_manager.prompts:
+        template_counter(name)
+    logging.info(f"Precounted {len(_templates)} prompt templates")